@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+from collections import defaultdict
+
+#Benchmarks run outside of dev_appserver, against the testbed stubs of the SDK.
+#Point APPENGINE_SDK to the google_appengine directory if it is not installed
+#in the default location.
+SDK_PATH = os.environ.get('APPENGINE_SDK', '/usr/local/google_appengine')
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def fix_sys_path():
+    if SDK_PATH not in sys.path:
+        sys.path.insert(0, SDK_PATH)
+    if ROOT_PATH not in sys.path:
+        sys.path.insert(0, ROOT_PATH)
+
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+fix_sys_path()
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import testbed
+
+
+def make_testbed(app_id = None):
+    tb = testbed.Testbed()
+    tb.activate()
+    if app_id:
+        tb.setup_env(app_id = app_id, overwrite = True)
+    tb.init_datastore_v3_stub(use_sqlite = True)
+    tb.init_memcache_stub()
+    #edits and comments are indexed as they are written
+    tb.init_search_stub()
+    return tb
+
+
+class RpcCounter(object):
+    #Counts the API calls (datastore_v3.RunQuery, memcache.Get...) made while
+    #it is installed. Must be created after the testbed is activated since the
+    #testbed replaces the stub map.
+
+    def __init__(self):
+        self.calls = defaultdict(int)
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'bench-rpc-counter-%d' % id(self), self.hook)
+
+    def hook(self, service, call, request, response):
+        self.calls['%s.%s' % (service, call)] += 1
+
+    def reset(self):
+        self.calls.clear()
+
+    def total(self, service = None):
+        return sum(n for name, n in self.calls.iteritems()
+                   if not service or name.startswith(service + '.'))
+
+
+def timed(f, *a, **kw):
+    start = time.time()
+    result = f(*a, **kw)
+    return result, (time.time() - start) * 1000.0
+
+
+def report(title, headers, rows):
+    print title
+    widths = [max(len(str(x)) for x in col) for col in zip(headers, *rows)]
+    line = '  '.join('%%-%ds' % w for w in widths)
+    print line % tuple(headers)
+    for row in rows:
+        print line % tuple(row)
+    print
@@ -0,0 +1,63 @@
+#Counts the datastore calls made while rendering a 500 comment thread, with
+#the authors resolved lazily by the template, prefetched in one batch, or
+#copied on the comments at write time.
+#
+#   python -m bench.authors
+
+import bench
+from google.appengine.ext import db
+
+from lib import data
+from handlers.base import jinja_env
+
+N = 500
+USERS = 50
+PATH = '/bench-authors'
+
+
+def seed(path, denormalized):
+    users = [data.User.register('user%d' % i, 'bench') for i in xrange(USERS)]
+    db.put(users)
+
+    comments = []
+    for i in xrange(N):
+        u = users[i % USERS]
+        c = data.Comment.new(path, 'comment %d' % i, u)
+        c.author_name = denormalized and u.name or None
+        comments.append(c)
+    db.put(comments)
+
+
+def render(comment_page):
+    t = jinja_env().get_template('page.html')
+    return t.render(page = data.Page(content = 'bench', pathPage = PATH), path = PATH,
+                    comment_page = comment_page,
+                    user = None, gray_style = None)
+
+
+def lazy(path):
+    return render(list(data.Comment.by_path(path)))
+
+def prefetched(path):
+    return render(list(data.CommentThread.load(path)))
+
+
+def main():
+    rows = []
+    for name, f, denormalized in (('lazy', lazy, False),
+                                  ('prefetch', prefetched, False),
+                                  ('author_name', prefetched, True)):
+        tb = bench.make_testbed()
+        rpc = bench.RpcCounter()
+        seed(PATH, denormalized)
+
+        rpc.reset()
+        html, ms = bench.timed(f, PATH)
+        rows.append((name, N, rpc.calls['datastore_v3.Get'], rpc.total('datastore_v3'), '%.1f' % ms))
+        tb.deactivate()
+
+    bench.report('Rendering %d comments' % N, ('authors', 'comments', 'gets', 'rpcs', 'ms'), rows)
+
+
+if __name__ == '__main__':
+    main()
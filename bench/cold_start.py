@@ -0,0 +1,60 @@
+#Time for a new python process to load every template, from the sources
+#(what a new instance did on its first requests) and from the modules made
+#by compile_templates.py. Each case runs in a fresh interpreter.
+#
+#   python -m bench.cold_start
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import bench
+from lib import templates
+
+RUNS = 5
+
+CHILD = '''
+import sys, time
+sys.path.insert(0, %(root)r)
+start = time.time()
+import jinja2
+from lib import templates
+if %(compiled_dir)r:
+    loader = jinja2.ModuleLoader(%(compiled_dir)r)
+else:
+    loader = jinja2.FileSystemLoader(templates.TEMPLATE_DIR)
+env = templates.make_env(loader)
+templates.warm_up(env)
+first = time.time()
+templates.warm_up(env)
+print (first - start) * 1000, (time.time() - first) * 1000
+'''
+
+
+def first_load(compiled_dir):
+    code = CHILD % dict(root = bench.ROOT_PATH, compiled_dir = compiled_dir)
+    out = subprocess.check_output([sys.executable, '-c', code])
+    return [float(x) for x in out.split()]
+
+
+def main():
+    compiled_dir = tempfile.mkdtemp()
+    try:
+        templates.source_env().compile_templates(compiled_dir, zip = None, ignore_errors = False)
+
+        rows = []
+        for name, d in (('source', ''), ('compiled', compiled_dir)):
+            times = [first_load(d) for i in xrange(RUNS)]
+            rows.append((name, len(templates.template_names()),
+                         '%.1f' % min(t[0] for t in times),
+                         '%.2f' % min(t[1] for t in times)))
+        bench.report('Loading the templates in a new process (best of %d)' % RUNS,
+                     ('templates', 'count', 'first load ms', 'warm ms'), rows)
+    finally:
+        shutil.rmtree(compiled_dir)
+
+
+if __name__ == '__main__':
+    main()
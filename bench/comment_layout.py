@@ -0,0 +1,81 @@
+#Concurrent comment writes on one page with the 'page' layout (one entity
+#group per page) and the 'thread' layout (one entity group per top-level
+#comment). Each writer posts a top-level comment, an answer to it and an
+#answer to the answer, in transactions as a handler doing read-modify-write
+#on its group would.
+#
+#   python -m bench.comment_layout
+
+import threading
+
+import bench
+from google.appengine.ext import db
+
+from lib import data
+
+THREADS = 16
+COMMENTS_PER_THREAD = 50
+PATH = '/bench-layout'
+
+
+def post(path, i):
+    def answer(content, reply_to):
+        c = data.Comment.new(path, content, None, reply_to = reply_to)
+        c.put()
+        return c
+    c = db.run_in_transaction(answer, 'comment %d' % i, None)
+    a = db.run_in_transaction(answer, 'answer %d' % i, c)
+    db.run_in_transaction(answer, 'answer to answer %d' % i, a)
+
+
+def run(path):
+    failed = []
+    def worker(n):
+        for i in xrange(COMMENTS_PER_THREAD):
+            try:
+                post(path, n * COMMENTS_PER_THREAD + i)
+            except db.TransactionFailedError:
+                failed.append(i)
+
+    threads = [threading.Thread(target = worker, args = (n,)) for n in xrange(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return failed
+
+
+def well_ordered(thread):
+    #top-level comments by creation time, each followed by its answers
+    roots = [c for c in thread if c.comment_level == 1]
+    if any(a.created > b.created for a, b in zip(roots, roots[1:])):
+        return False
+    above = []
+    for c in thread:
+        #the comments c may answer: the one before it and those it is under
+        above = above[:c.comment_level - 1]
+        answered = data.Comment.reply_to.get_value_for_datastore(c)
+        if len(above) != c.comment_level - 1 or (above and above[-1].key() != answered):
+            return False
+        above.append(c)
+    return True
+
+
+def main():
+    rows = []
+    for layout in ('page', 'thread'):
+        data.COMMENT_LAYOUT = layout
+        tb = bench.make_testbed()
+
+        failed, ms = bench.timed(run, PATH)
+        thread = list(data.CommentThread.load(PATH, size = THREADS * COMMENTS_PER_THREAD + 1))
+
+        n = THREADS * COMMENTS_PER_THREAD
+        rows.append((layout, n, len(failed), len(thread), well_ordered(thread), '%.0f' % (n / (ms / 1000.0))))
+        tb.deactivate()
+
+    bench.report('Concurrent comments on one page', ('layout', 'comments', 'failed', 'thread rows', 'ordered', 'comments/s'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#Compares loading a thread of any depth level by level, one query for the
+#answers of each comment, with CommentThread.load, one range query on the
+#materialized thread_path.
+#
+#   python -m bench.comment_thread
+
+import random
+
+import bench
+
+from lib import data
+
+SIZES = (10, 100, 1000)
+PATH = '/bench-thread'
+
+
+def seed(path, n):
+    author = data.User.register('bench', 'bench')
+    author.put()
+
+    #half the comments answer an earlier one, so the threads get deep unevenly
+    comments = []
+    for i in xrange(n):
+        reply_to = random.choice(comments) if comments and random.random() < 0.5 else None
+        c = data.Comment.new(path, 'comment %d' % i, author, reply_to = reply_to)
+        c.put()
+        comments.append(c)
+
+
+def level_load(path):
+    #what deeper threads would cost without thread_path
+    rows = []
+    def walk(comments):
+        for c in comments:
+            rows.append(c)
+            walk(c.answers.order('created'))
+    walk(data.Comment.by_path(path).filter('comment_level =', 1))
+    return rows
+
+
+def thread_load(path):
+    #a page size larger than the thread, to load all of it
+    return list(data.CommentThread.load(path, size = max(SIZES) + 1))
+
+
+def main():
+    rows = []
+    for n in SIZES:
+        tb = bench.make_testbed()
+        rpc = bench.RpcCounter()
+        path = '%s-%d' % (PATH, n)
+        seed(path, n)
+        depth = max(c.comment_level for c in data.Comment.by_path(path))
+
+        for name, f in (('levels', level_load), ('thread', thread_load)):
+            rpc.reset()
+            result, ms = bench.timed(f, path)
+            rows.append((n, depth, name, len(result), rpc.calls['datastore_v3.RunQuery'],
+                         rpc.total('datastore_v3'), '%.1f' % ms))
+        tb.deactivate()
+
+    bench.report('Comment thread load', ('comments', 'depth', 'loader', 'rows', 'queries', 'rpcs', 'ms'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#Import-time profile of a new instance (python 2.7 has no -X importtime):
+#time and number of modules loaded by importing main alone, by the first
+#request to a wiki page, and by loading every handler module as main.py did
+#before handlers were imported lazily. Each case runs in a fresh interpreter.
+#
+#   python -m bench.import_time
+
+import json
+import subprocess
+import sys
+
+import bench
+
+RUNS = 5
+
+CASES = (('main', ['main']),
+         ('main + wiki page', ['main', 'handlers.wiki']),
+         ('every handler', ['main', 'handlers.auth', 'handlers.wiki',
+                            'handlers.conversation', 'handlers.admin']))
+
+CHILD = '''
+import sys, time, json, __builtin__
+sys.path[:0] = [%(sdk)r, %(root)r]
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+cumulative = {}
+real_import = __builtin__.__import__
+def timed_import(name, *a, **kw):
+    if name in sys.modules:
+        return real_import(name, *a, **kw)
+    start = time.time()
+    try:
+        return real_import(name, *a, **kw)
+    finally:
+        cumulative.setdefault(name, (time.time() - start) * 1000)
+__builtin__.__import__ = timed_import
+
+before = len(sys.modules)
+start = time.time()
+for name in %(modules)r:
+    __import__(name)
+total = (time.time() - start) * 1000
+print json.dumps(dict(ms = total, modules = len(sys.modules) - before,
+                      slowest = sorted(cumulative.items(), key = lambda x: -x[1])[:10]))
+'''
+
+
+def profile(modules):
+    code = CHILD % dict(sdk = bench.SDK_PATH, root = bench.ROOT_PATH, modules = modules)
+    return json.loads(subprocess.check_output([sys.executable, '-c', code]))
+
+
+def main():
+    rows = []
+    slowest = None
+    for name, modules in CASES:
+        runs = [profile(modules) for i in xrange(RUNS)]
+        best = min(runs, key = lambda r: r['ms'])
+        rows.append((name, best['modules'], '%.1f' % best['ms']))
+        slowest = best['slowest']
+    bench.report('Imports on a new instance (best of %d)' % RUNS, ('case', 'modules', 'ms'), rows)
+    bench.report('Slowest imports, every handler (cumulative)', ('module', 'ms'),
+                 [(m, '%.1f' % ms) for m, ms in slowest])
+
+
+if __name__ == '__main__':
+    main()
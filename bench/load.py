@@ -0,0 +1,184 @@
+#Latency and throughput of every route of main.app, on a seeded site (pages
+#with revisions, comments with replies, users), with the API calls of each
+#request read from the X-Trace-* headers of lib/instrument.py. The report is
+#JSON, on stdout unless --output is given. Given a previous report as
+#--baseline, the routes that got slower or make more datastore calls are
+#listed and the exit status is 1, for CI.
+#
+#   python -m bench.load --output baseline.json
+#   python -m bench.load --baseline baseline.json
+
+import argparse
+import json
+import sys
+import time
+
+import bench
+from google.appengine.api import memcache
+from google.appengine.ext import db
+import webapp2
+
+from lib import data, trace, utils
+from main import app
+
+PASSWORD = 'bench'
+
+
+def seed(pages, revisions, comments, replies, users):
+    us = [data.User.create('user%d' % i, PASSWORD) for i in xrange(users)]
+
+    paths = ['/page%d' % i for i in xrange(pages)]
+    for path in paths + ['/user/' + u.name for u in us]:
+        for r in xrange(revisions):
+            head = data.Page.save(path, '<p>%s</p>\n' % path + 'line %d\n' % r * 20)
+        data.SiteMap.touch(path, head.lastModified)
+
+    comment_ids = {}
+    for n, path in enumerate(paths):
+        cs = [data.Comment.new(path, 'comment %d on %s' % (i, path), us[(n + i) % users])
+              for i in xrange(comments)]
+        db.put(cs)
+        db.put([data.Comment.new(path, 'reply %d' % j, us[(n + j) % users], reply_to = c)
+                for c in cs for j in xrange(replies)])
+        comment_ids[path] = [c.key().id() for c in cs]
+
+    memcache.flush_all()
+    return us, paths, comment_ids
+
+
+def routes(us, paths, comment_ids):
+    #name -> (method, function of the request number returning (url, POST
+    #params or None), logged in)
+    def page(i):
+        return paths[i % len(paths)]
+
+    def comment(i):
+        ids = comment_ids[page(i)]
+        return '/comment%s?id=%d' % (page(i), ids[i % len(ids)])
+
+    return [
+        ('page anonymous', 'GET', lambda i: (page(i), None), False),
+        ('page', 'GET', lambda i: (page(i), None), True),
+        ('poll comments', 'GET', lambda i: (page(i) + '.json', None), False),
+        ('user page', 'GET', lambda i: ('/user/' + us[i % len(us)].name, None), True),
+        ('comment', 'GET', lambda i: (comment(i), None), True),
+        ('history', 'GET', lambda i: ('/_history' + page(i), None), True),
+        ('edit', 'GET', lambda i: ('/_edit' + page(i), None), True),
+        ('login form', 'GET', lambda i: ('/login', None), False),
+        ('signup form', 'GET', lambda i: ('/signup', None), False),
+        ('login', 'POST', lambda i: ('/login', dict(username = us[i % len(us)].name,
+                                                    password = PASSWORD)), False),
+        ('signup', 'POST', lambda i: ('/signup', dict(username = 'new%d' % i, password = PASSWORD,
+                                                      verify = PASSWORD, email = '')), False),
+        ('post comment', 'POST', lambda i: (page(i), dict(content = 'bench %d' % i)), True),
+        ('post reply', 'POST', lambda i: (comment(i), dict(content = 'bench %d' % i)), True),
+        ('edit page', 'POST', lambda i: ('/_edit' + page(i), dict(content = 'edit %d' % i)), True),
+    ]
+
+
+def request(url, method, post, cookie):
+    req = webapp2.Request.blank(url, POST = post)
+    req.method = method
+    if cookie:
+        req.headers['Cookie'] = 'user_id=%s' % utils.make_secure_val(cookie)
+    return req.get_response(app)
+
+
+def run_route(method, make, cookie, n, cold):
+    times, statuses = [], {}
+    calls = {'datastore_v3': 0, 'memcache': 0}
+    over_budget = 0
+
+    start = time.time()
+    for i in xrange(n):
+        if cold:
+            memcache.flush_all()
+        url, post = make(i)
+        t = time.time()
+        resp = request(url, method, post, cookie)
+        times.append((time.time() - t) * 1000)
+
+        statuses[resp.status_int] = statuses.get(resp.status_int, 0) + 1
+        for s in calls:
+            calls[s] += int(resp.headers.get('X-Trace-%s-Calls' % s, 0))
+        over_budget += 'X-Trace-Over-Budget' in resp.headers
+    wall = time.time() - start
+
+    times.sort()
+    return dict(requests = n,
+                per_second = round(n / wall, 1),
+                p50_ms = round(trace.percentile(times, 50), 2),
+                p95_ms = round(trace.percentile(times, 95), 2),
+                max_ms = round(times[-1], 2),
+                datastore_calls = round(calls['datastore_v3'] / float(n), 2),
+                memcache_calls = round(calls['memcache'] / float(n), 2),
+                over_budget = over_budget,
+                statuses = statuses)
+
+
+def compare(report, baseline, tolerance):
+    #rows of the routes slower than the baseline by more than tolerance, or
+    #making more datastore calls
+    rows = []
+    for name, r in sorted(report['routes'].iteritems()):
+        b = baseline['routes'].get(name)
+        if not b:
+            continue
+        slower = r['p50_ms'] > b['p50_ms'] * (1 + tolerance)
+        more_calls = r['datastore_calls'] > b['datastore_calls']
+        if slower or more_calls:
+            rows.append((name, b['p50_ms'], r['p50_ms'], b['datastore_calls'], r['datastore_calls']))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Load test of every route of main.app.')
+    parser.add_argument('--pages', type = int, default = 20)
+    parser.add_argument('--revisions', type = int, default = 5)
+    parser.add_argument('--comments', type = int, default = 50, help = 'per page')
+    parser.add_argument('--replies', type = int, default = 2, help = 'per comment')
+    parser.add_argument('--users', type = int, default = 20)
+    parser.add_argument('--requests', type = int, default = 100, help = 'per route')
+    parser.add_argument('--cold', action = 'store_true', help = 'flush memcache before each request')
+    parser.add_argument('--output', help = 'write the JSON report to this file')
+    parser.add_argument('--baseline', help = 'JSON report to compare with')
+    parser.add_argument('--tolerance', type = float, default = 0.2,
+                        help = 'p50 increase over the baseline allowed, 0.2 for 20%%')
+    args = parser.parse_args()
+
+    tb = bench.make_testbed()
+    tb.init_taskqueue_stub()
+    us, paths, comment_ids = seed(args.pages, args.revisions, args.comments, args.replies, args.users)
+    cookie = str(us[0].key().id())
+
+    report = dict(config = dict((k, getattr(args, k)) for k in
+                                ('pages', 'revisions', 'comments', 'replies', 'users', 'requests', 'cold')),
+                  routes = {})
+    for name, method, make, logged_in in routes(us, paths, comment_ids):
+        #one request first, for the imports and compiled templates
+        url, post = make(args.requests)
+        request(url, method, post, logged_in and cookie)
+        report['routes'][name] = run_route(method, make, logged_in and cookie, args.requests, args.cold)
+    tb.deactivate()
+
+    s = json.dumps(report, indent = 2, sort_keys = True)
+    if not args.output:
+        print s
+    else:
+        with open(args.output, 'w') as f:
+            f.write(s)
+        bench.report('Routes', ('route', 'req/s', 'p50 ms', 'p95 ms', 'datastore', 'memcache', 'over budget'),
+                     [(name, r['per_second'], r['p50_ms'], r['p95_ms'],
+                       r['datastore_calls'], r['memcache_calls'], r['over_budget'])
+                      for name, r in sorted(report['routes'].iteritems())])
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            rows = compare(report, json.load(f), args.tolerance)
+        if rows:
+            bench.report('Regressions', ('route', 'p50 before', 'p50 now', 'datastore before', 'datastore now'), rows)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#Private messages: the cost of sending one (Dialogue.send, one cross-group
+#transaction), and of reading an inbox and a page of a conversation as the
+#number of messages grows. The reads should stay flat.
+#
+#   python -m bench.messages
+
+import random
+
+import bench
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import testbed
+
+from lib import data
+
+USERS = 50
+SIZES = (100, 1000, 10000)
+READS = 20
+
+
+def make_testbed():
+    #cross-group transactions need the high replication datastore
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub(use_sqlite = True,
+                              consistency_policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability = 1))
+    tb.init_memcache_stub()
+    return tb
+
+
+def send(us, n, rng):
+    #the first user is in about one conversation out of two
+    for i in xrange(n):
+        a = us[0] if rng.random() < 0.5 else rng.choice(us[1:])
+        b = rng.choice([u for u in us if u is not a])
+        data.Dialogue.send(a, b, 'message %d from %s to %s' % (i, a.name, b.name))
+
+
+def read_inbox(name):
+    return data.InboxEntry.by_user(name).fetch(data.INBOX_PER_PAGE)
+
+def read_conversation(name, other):
+    return data.Dialogue.by_conversation(name, other).fetch(data.MESSAGES_PER_PAGE)
+
+
+def main():
+    rows = []
+    for n in SIZES:
+        rng = random.Random(0)
+        tb = make_testbed()
+        us = [data.User.register('user%d' % i, 'bench') for i in xrange(USERS)]
+        for u in us:
+            u.put()
+
+        rpc = bench.RpcCounter()
+        ignored, ms = bench.timed(send, us, n, rng)
+        rows.append((n, 'send', '%.2f' % (ms / n), '%.1f' % (rpc.total('datastore_v3') / float(n))))
+
+        other = read_inbox(us[0].name)[0].other
+        for name, f, args in (('inbox', read_inbox, (us[0].name,)),
+                              ('conversation', read_conversation, (us[0].name, other))):
+            rpc.reset()
+            ignored, ms = bench.timed(lambda: [f(*args) for i in xrange(READS)])
+            rows.append((n, name, '%.2f' % (ms / READS), '%.1f' % (rpc.total('datastore_v3') / float(READS))))
+        tb.deactivate()
+
+    bench.report('Private messages', ('messages', 'operation', 'ms', 'datastore rpcs'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#Storage and read latency of a page edited 1000 times, each revision
+#changing a few lines of a 200 line page.
+#
+#   python -m bench.page_revisions
+
+import random
+
+import bench
+
+from lib import data
+
+REVISIONS = 1000
+LINES = 200
+PATH = '/bench-revisions'
+
+
+def seed(path):
+    lines = ['<p>line %d of the page</p>\n' % i for i in xrange(LINES)]
+    for n in xrange(REVISIONS):
+        for i in random.sample(xrange(LINES), 3):
+            lines[i] = '<p>line %d, edit %d</p>\n' % (i, n)
+        data.Page.save(path, ''.join(lines))
+
+
+def stored_bytes(path):
+    full = stored = 0
+    revisions = list(data.Page.by_path(path).run(batch_size = 1000))
+    data.Page.fill_content(path, revisions)
+    for r in data.Page.by_path(path).run(batch_size = 1000):
+        stored += len(r.content or '') + len(r.delta or '')
+    for r in revisions:
+        full += len(r.content)
+    return full, stored
+
+
+def main():
+    tb = bench.make_testbed()
+    seed(PATH)
+
+    full, stored = stored_bytes(PATH)
+    bench.report('Storage for %d revisions' % REVISIONS, ('full copies', 'with deltas', 'ratio'),
+                 [(full, stored, '%.3f' % (float(stored) / full))])
+
+    oldest = data.Page.all().ancestor(data.Page.parent_key(PATH)).order('created').get()
+
+    rows = []
+    for name, f in (('head', lambda: data.PageHead.by_path(PATH)),
+                    ('latest by sort', lambda: data.Page.by_path(PATH).get()),
+                    ('history page 1', lambda: data.Page.fill_content(PATH, data.Page.by_path(PATH).fetch(data.HISTORY_PER_PAGE))),
+                    ('oldest revision', lambda: data.Page.revision(oldest.key().id(), PATH))):
+        result, ms = bench.timed(f)
+        rows.append((name, '%.1f' % ms))
+    bench.report('Reads', ('read', 'ms'), rows)
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#Comment posts per second on a page with 200 comments: a post that renders
+#the whole page inline from the datastore (as the handlers used to), against
+#Post/Redirect/Get where the redirected view is served from the caches the
+#post just updated.
+#
+#   python -m bench.post_redirect
+
+import bench
+from google.appengine.api import memcache
+from google.appengine.ext import db
+import webapp2
+
+from lib import data, utils
+from main import app
+
+COMMENTS = 200
+POSTS = 100
+PATH = '/bench-posts'
+
+
+def seed(path):
+    data.Page.save(path, '<p>bench</p>')
+    u = data.User.create('bench', 'bench')
+    db.put([data.Comment.new(path, 'comment %d' % i, u) for i in xrange(COMMENTS)])
+    return u
+
+
+def request(path, cookie, method = 'GET', **post):
+    req = webapp2.Request.blank(path, POST = post or None)
+    req.method = method
+    req.headers['Cookie'] = 'user_id=%s' % utils.make_secure_val(cookie)
+    return req.get_response(app)
+
+
+def inline(path, cookie, i):
+    #what a post used to cost: the write, then every read of the page
+    request(path, cookie, 'POST', content = 'post %d' % i)
+    memcache.flush_all()
+    request(path, cookie)
+
+def redirect(path, cookie, i):
+    resp = request(path, cookie, 'POST', content = 'post %d' % i)
+    request(resp.location, cookie)
+
+
+def main():
+    rows = []
+    for name, f in (('inline', inline), ('redirect', redirect)):
+        tb = bench.make_testbed()
+        rpc = bench.RpcCounter()
+        cookie = str(seed(PATH).key().id())
+
+        rpc.reset()
+        result, ms = bench.timed(lambda: [f(PATH, cookie, i) for i in xrange(POSTS)])
+        rows.append((name, POSTS, '%.1f' % (POSTS / (ms / 1000.0)),
+                     rpc.total('datastore_v3') / POSTS))
+        tb.deactivate()
+
+    bench.report('Comment posts', ('write path', 'posts', 'posts/s', 'datastore rpcs/post'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#Search latency over a site of 10k pages and 100k comments (smaller with
+#--pages/--comments), against the search stub of the SDK: indexing
+#throughput, then the latency of queries on common and rare words, several
+#words, and the following pages of results through cursors.
+#
+#   python -m bench.search
+#   python -m bench.search --pages 1000 --comments 10000
+
+import argparse
+import random
+
+import bench
+from google.appengine.ext import db
+
+from lib import data, fulltext, trace
+
+WORDS = 5000
+WORDS_PER_PAGE = 200
+WORDS_PER_COMMENT = 30
+QUERIES = 50
+
+
+def word(i):
+    return 'mot%d' % i
+
+def text(rng, n):
+    #word frequencies fall off with their rank, as in real text
+    return ' '.join(word(int(rng.paretovariate(1.2)) % WORDS) for i in xrange(n))
+
+
+def seed(pages, comments, rng):
+    paths = ['/page%d' % i for i in xrange(pages)]
+    docs = [fulltext.page_document(data.PageHead(key = data.PageHead.key_for(path), pathPage = path,
+                                                 content = '<p>%s</p>' % text(rng, WORDS_PER_PAGE),
+                                                 revision = 1))
+            for path in paths]
+    for i in xrange(comments):
+        path = paths[i % pages]
+        #documents only need the keys, the entities are not stored
+        c = data.Comment(key = db.Key.from_path('Comment', i + 1, parent = data.comments_root(path)),
+                         pathPage = path, content = text(rng, WORDS_PER_COMMENT),
+                         author_name = 'user%d' % (i % 100))
+        docs.append(fulltext.comment_document(c))
+
+    index = fulltext._index()
+    for i in xrange(0, len(docs), fulltext.REINDEX_BATCH):
+        index.put(docs[i:i + fulltext.REINDEX_BATCH])
+    return len(docs)
+
+
+def latency(queries, pages):
+    times = []
+    for q in queries:
+        cursor, prev = None, None
+        for n in xrange(pages):
+            (results, pager), ms = bench.timed(fulltext.find, q, cursor, prev)
+            times.append(ms)
+            if not pager.has_next:
+                break
+            cursor, prev = pager.next_cursor, ','.join(pager.prev + [pager.cursor])
+    times.sort()
+    return len(times), trace.percentile(times, 50), trace.percentile(times, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Search latency on the search stub.')
+    parser.add_argument('--pages', type = int, default = 10000)
+    parser.add_argument('--comments', type = int, default = 100000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    tb = bench.make_testbed()
+
+    n, ms = bench.timed(seed, args.pages, args.comments, rng)
+    bench.report('Indexing', ('documents', 's', 'documents/s'),
+                 [(n, '%.1f' % (ms / 1000), '%.0f' % (n / (ms / 1000)))])
+
+    common = [word(i) for i in xrange(1, 6)]
+    #a few dozen documents each
+    rare = [word(i) for i in xrange(200, 200 + QUERIES)]
+    rows = []
+    for name, queries, pages in (('common word', common, 1),
+                                 ('rare word', rare, 1),
+                                 ('two words', ['%s %s' % (a, b) for a, b in zip(common, rare)], 1),
+                                 ('common word, 3 pages', common, 3)):
+        count, p50, p95 = latency(queries, pages)
+        rows.append((name, count, '%.1f' % p50, '%.1f' % p95))
+    tb.deactivate()
+
+    bench.report('Queries on %d pages, %d comments' % (args.pages, args.comments),
+                 ('query', 'requests', 'p50 ms', 'p95 ms'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#Export and import throughput of lib/transfer.py against the datastore stub:
+#a site with users, pages with revisions, comment threads and votes is
+#exported to memory and imported into an empty datastore of another app.
+#That one is exported and imported back into the first app to check that
+#the dumps are identical.
+#
+#   python -m bench.transfer
+
+import argparse
+from cStringIO import StringIO
+
+import bench
+from google.appengine.ext import db
+
+from lib import data, transfer
+
+
+def seed(users, pages, revisions, comments):
+    us = [data.User.register('user%d' % i, 'bench') for i in xrange(users)]
+    db.put(us)
+    db.put([data.UserName(key = data.UserName.key_for(u.name), user_id = u.key().id()) for u in us])
+
+    for i in xrange(pages):
+        path = '/page%d' % i
+        for r in xrange(revisions):
+            data.Page.save(path, '<p>%s</p>\n' % path + 'revision %d\n' % r * 10)
+        cs = [data.Comment.new(path, 'comment %d' % j, us[j % users]) for j in xrange(comments)]
+        db.put(cs)
+        db.put([data.Comment.new(path, 'reply', c.author, reply_to = c) for c in cs])
+        #votes are keyed by the comment key
+        targets = [str(c.key()) for c in cs]
+        db.put([data.VoteShard(key = data.VoteShard.key_for(t, 0), target = t, up = 1) for t in targets] +
+               [data.VoteTotal(key = data.VoteTotal.key_for(t), up = 1) for t in targets] +
+               [data.Vote(key = data.Vote.key_for(t, us[0].key().id()), direction = 'up') for t in targets])
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Bulk export/import throughput.')
+    parser.add_argument('--users', type = int, default = 100)
+    parser.add_argument('--pages', type = int, default = 200)
+    parser.add_argument('--revisions', type = int, default = 5)
+    parser.add_argument('--comments', type = int, default = 20, help = 'per page, each with a reply')
+    args = parser.parse_args()
+
+    tb = bench.make_testbed()
+    seed(args.users, args.pages, args.revisions, args.comments)
+    out = StringIO()
+    n, export_ms = bench.timed(transfer.export, out)
+    dump = out.getvalue()
+    tb.deactivate()
+
+    tb = bench.make_testbed(app_id = 'bench-restore')
+    n_in, import_ms = bench.timed(transfer.import_, StringIO(dump))
+    moved = StringIO()
+    transfer.export(moved)
+    tb.deactivate()
+
+    tb = bench.make_testbed()
+    transfer.import_(StringIO(moved.getvalue()))
+    again = StringIO()
+    transfer.export(again)
+    tb.deactivate()
+
+    bench.report('Bulk transfer (%d bytes, %.0f bytes/entity)' % (len(dump), len(dump) / float(n)),
+                 ('step', 'entities', 'ms', 'entities/s'),
+                 [('export', n, '%.0f' % export_ms, '%.0f' % (n / (export_ms / 1000))),
+                  ('import', n_in, '%.0f' % import_ms, '%.0f' % (n_in / (import_ms / 1000)))])
+    entities = lambda s: [l for l in s.splitlines() if not transfer.parse_checkpoint(l)]
+    print 'round trip identical:', entities(again.getvalue()) == entities(dump)
+
+
+if __name__ == '__main__':
+    main()
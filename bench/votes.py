@@ -0,0 +1,76 @@
+#Sustained votes per second on a single hot comment, from concurrent
+#threads: incrementing upVotes on the comment entity in a transaction (its
+#entity group is the whole page's comments) against the memcache buffered
+#sharded counters.
+#
+#   python -m bench.votes
+
+import itertools
+import threading
+
+import bench
+from google.appengine.ext import db
+
+from lib import data, votes
+
+THREADS = 8
+VOTES_PER_THREAD = 200
+PATH = '/bench-votes'
+
+
+def in_place(target):
+    def txn():
+        c = db.get(target)
+        c.upVotes += 1
+        c.put()
+    db.run_in_transaction(txn)
+
+#every vote from another user, a user only counts once per comment
+_voters = itertools.count(1)
+
+def sharded(target):
+    votes.vote(str(target), next(_voters), 'up')
+
+
+def run(f, target):
+    errors = []
+    def worker():
+        for i in xrange(VOTES_PER_THREAD):
+            try:
+                f(target)
+            except db.TransactionFailedError:
+                errors.append(i)
+
+    threads = [threading.Thread(target = worker) for i in xrange(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+def main():
+    rows = []
+    for name, f in (('in place', in_place), ('sharded', sharded)):
+        tb = bench.make_testbed()
+        tb.init_taskqueue_stub()
+        c = data.Comment(parent = data.Comment.parent_key(PATH), content = 'hot', pathPage = PATH)
+        c.put()
+
+        errors, ms = bench.timed(run, f, c.key())
+        if f is sharded:
+            #what the scheduled flush task does
+            votes.flush(str(c.key()))
+            up = votes.attach([c])[0].upVotes
+        else:
+            up = db.get(c.key()).upVotes
+
+        n = THREADS * VOTES_PER_THREAD
+        rows.append((name, n, up, len(errors), '%.0f' % (n / (ms / 1000.0))))
+        tb.deactivate()
+
+    bench.report('Votes on one comment', ('counter', 'votes', 'counted', 'failed', 'votes/s'), rows)
+
+
+if __name__ == '__main__':
+    main()
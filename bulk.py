@@ -0,0 +1,92 @@
+#Exports the datastore of a deployed (or local) application to a dump file,
+#or imports a dump, through remote_api (builtins in app.yaml). See
+#lib/transfer.py for the format. An interrupted export or import started
+#again with the same file continues from its last checkpoint.
+#
+#   python bulk.py export --host myapp.appspot.com dump.txt
+#   python bulk.py import --host localhost:8080 dump.txt
+
+import argparse
+import os
+import sys
+import time
+
+SDK_PATH = os.environ.get('APPENGINE_SDK', '/usr/local/google_appengine')
+
+
+def connect(host):
+    sys.path.insert(0, SDK_PATH)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+    from google.appengine.ext.remote_api import remote_api_stub
+    remote_api_stub.ConfigureRemoteApiForOAuth(host, '/_ah/remote_api',
+                                               secure = not host.startswith('localhost'))
+
+
+def reporter(start):
+    def progress(count):
+        sys.stderr.write('\r%d entities, %.0f/s' % (count, count / max(time.time() - start, 0.001)))
+    return progress
+
+
+def export(path, kinds):
+    from lib import transfer
+
+    #continue after the last checkpoint, dropping the lines of the batch that
+    #was being written
+    start, offset = None, 0
+    if os.path.exists(path):
+        with open(path) as f:
+            pos = 0
+            for line in f:
+                pos += len(line)
+                c = transfer.parse_checkpoint(line)
+                if c:
+                    start, offset = c, pos
+
+    with open(path, 'a') as out:
+        out.truncate(offset)
+        return transfer.export(out, kinds, start, progress = reporter(time.time()))
+
+
+def import_(path):
+    from google.appengine.api import memcache
+    from lib import transfer
+
+    checkpoint = path + '.checkpoint'
+    skip = 0
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            skip = int(f.read() or 0)
+
+    report = reporter(time.time())
+    def progress(count):
+        with open(checkpoint, 'w') as f:
+            f.write(str(count))
+        report(count - skip)
+
+    with open(path) as f:
+        count = transfer.import_(f, skip, progress = progress)
+    os.remove(checkpoint)
+    #the cached pages, threads and users are those of the old data
+    memcache.flush_all()
+    return count - skip
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Bulk export/import of the datastore.')
+    parser.add_argument('command', choices = ('export', 'import'))
+    parser.add_argument('file')
+    parser.add_argument('--host', default = 'localhost:8080')
+    parser.add_argument('--kind', action = 'append', help = 'export only these kinds')
+    args = parser.parse_args()
+
+    connect(args.host)
+    start = time.time()
+    if args.command == 'export':
+        from lib import transfer
+        count = export(args.file, args.kind or transfer.KINDS)
+    else:
+        count = import_(args.file)
+    print '\n%s: %d entities in %.1fs' % (args.command, count, time.time() - start)
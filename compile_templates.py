@@ -0,0 +1,17 @@
+#Compiles templates/ to python modules in templates_compiled/, loaded by
+#the application instead of parsing the templates on each new instance.
+#Run it before every deploy, with the jinja2 version pinned in app.yaml:
+#
+#   python compile_templates.py && appcfg.py update .
+
+import os
+import shutil
+
+from lib import templates
+
+if __name__ == '__main__':
+    if os.path.isdir(templates.COMPILED_DIR):
+        shutil.rmtree(templates.COMPILED_DIR)
+    templates.source_env().compile_templates(templates.COMPILED_DIR, zip = None,
+                                             ignore_errors = False)
+    print 'compiled %d templates to %s' % (len(templates.template_names()), templates.COMPILED_DIR)
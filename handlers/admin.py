@@ -0,0 +1,58 @@
+from lib import data, cache, votes, templates, trace, instrument, fulltext, migration
+
+from handlers.base import Handler, jinja_env
+
+
+class Warmup(Handler):
+    def get(self):
+        #sent by App Engine before routing traffic to a new instance
+        templates.warm_up(jinja_env())
+        data.SiteMap.all_pages()
+        data.RecentComments.latest()
+
+
+class CacheStats(Handler):
+    def get(self):
+        self.render_json(cache.stats())
+
+class TraceStats(Handler):
+    #/_admin/trace.json for scripts
+    def get(self):
+        stats = trace.stats()
+        over_budget = instrument.budget_stats()
+        if self.format == 'json':
+            return self.render_json(dict(handlers = stats, over_budget = over_budget))
+
+        handlers = [(h, sorted(series.iteritems())) for h, series in sorted(stats.iteritems())]
+        self.render("trace.html", handlers = handlers, over_budget = over_budget)
+
+class MigrateUsers(Handler):
+    #GET starts the migration, the tasks POST the batches
+    def get(self):
+        migration.user_names()
+        self.write('migrating')
+
+    def post(self):
+        migration.user_names(self.request.get('cursor'))
+
+class MigrateComments(Handler):
+    #GET starts the migration, the tasks POST the batches
+    def get(self):
+        migration.threads()
+        self.write('migrating')
+
+    def post(self):
+        migration.threads(self.request.get('kind'), self.request.get('cursor'))
+
+class FlushVotes(Handler):
+    def post(self):
+        votes.flush(self.request.get('target'))
+
+class ReindexSearch(Handler):
+    #GET starts rebuilding the search index, the tasks POST the batches
+    def get(self):
+        fulltext.reindex()
+        self.write('reindexing')
+
+    def post(self):
+        fulltext.reindex(self.request.get('kind'), self.request.get('cursor'))
@@ -0,0 +1,79 @@
+from lib import utils, data
+
+from handlers.base import Handler
+
+
+class Signup(Handler):
+    def get(self):
+        next_url = self.request.headers.get('referer', '/')
+        self.render("signup-form.html", next_url = next_url)
+
+    def post(self):
+        have_error = False
+        
+        next_url = str(self.request.get('next_url'))
+        if not next_url or next_url.startswith('/login'):
+            next_url = '/'
+        
+        self.username = self.request.get('username')
+        self.password = self.request.get('password')
+        self.verify = self.request.get('verify')
+        self.email = self.request.get('email')
+
+        params = dict(username = self.username,
+                      email = self.email)
+
+        if not utils.valid_username(self.username):
+            params['error_username'] = "That's not a valid username."
+            have_error = True
+
+        if not utils.valid_password(self.password):
+            params['error_password'] = "That wasn't a valid password."
+            have_error = True
+        elif self.password != self.verify:
+            params['error_verify'] = "Your passwords didn't match."
+            have_error = True
+
+        if not utils.valid_email(self.email):
+            params['error_email'] = "That's not a valid email."
+            have_error = True
+
+        if have_error:
+            self.render('signup-form.html', **params)
+        else:           
+            #make sure the user doesn't already exist, the name is claimed
+            #in a transaction by create
+            u = not data.User.by_name(self.username) and data.User.create(self.username, self.password, self.email)
+            if not u:
+                msg = 'That user already exists.'
+                self.render('signup-form.html', error_username = msg)
+            else:
+                self.login(u)
+                self.redirect(next_url)
+
+class Login(Handler):
+    def get(self):
+        next_url = self.request.headers.get('referer', '/')
+        self.render('login-form.html', next_url = next_url)
+
+    def post(self):
+        username = self.request.get('username')
+        password = self.request.get('password')
+        
+        next_url = str(self.request.get('next_url'))
+        if not next_url or next_url.startswith('/login'):
+            next_url = '/'
+        
+        u = data.User.login(username, password)
+        if u:
+            self.login(u)
+            self.redirect(next_url)
+        else:
+            msg = 'Invalid login'
+            self.render('login-form.html', error = msg)
+
+class Logout(Handler):
+    def get(self):
+        next_url = self.request.headers.get('referer', '/')
+        self.logout()
+        self.redirect(next_url)
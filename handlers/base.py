@@ -0,0 +1,126 @@
+import calendar
+import hashlib
+import json
+from email.utils import formatdate, parsedate_tz, mktime_tz
+
+import webapp2
+
+from lib import utils, session, templates, data, fragments, trace, cache
+
+#anonymous viewers all get the same document, shared caches may keep it for
+#a few seconds
+ANONYMOUS_MAX_AGE = 10
+
+_jinja_env = None
+
+def jinja_env():
+    #built on the first render, not when the module is imported
+    global _jinja_env
+    if _jinja_env is None:
+        env = templates.runtime_env()
+        env.fragment_cache = fragments
+        #sidebars of base.html, only called when their fragment is not cached
+        env.globals.update(site_map = data.SiteMap.all_pages,
+                           recent_comments = data.RecentComments.latest)
+        _jinja_env = env
+    return _jinja_env
+
+
+class Handler(webapp2.RequestHandler):
+    def write(self, *a, **kw):
+        self.response.out.write(*a, **kw)
+
+    def render_str(self, template, **params):
+        params['user'] = self.user
+        params['gray_style'] = utils.gray_style
+        with trace.stage('render'):
+            t = jinja_env().get_template(template)
+            return t.render(params)
+
+    def render(self, template, **kw):
+        self.write(self.render_str(template, **kw))
+
+    def render_json(self, d):
+        json_txt = json.dumps(d)
+        self.response.headers['Content-Type'] = 'application/json; charset=UTF-8'
+        self.write(json_txt)
+
+    def set_secure_cookie(self, name, val):
+        cookie_val = utils.make_secure_val(val)
+        self.response.headers.add_header(
+            'Set-Cookie',
+            '%s=%s; Path=/' % (name, cookie_val))
+
+    def read_secure_cookie(self, name):
+        cookie_val = self.request.cookies.get(name)
+        return cookie_val and utils.check_secure_val(cookie_val)
+
+    def login(self, user):
+        self.set_secure_cookie('user_id', str(user.key().id()))
+
+    def logout(self):
+        self.response.headers.add_header('Set-Cookie', 'user_id=; Path=/')
+
+    @webapp2.cached_property
+    def user(self):
+        #resolved on first use: requests without the cookie never reach the
+        #datastore, the others mostly hit the session cache
+        uid = self.read_secure_cookie('user_id')
+        if not uid:
+            return None
+        with trace.stage('user'):
+            return session.get_user(int(uid))
+
+    def dispatch(self):
+        #the request trace itself is opened by lib.instrument.Middleware
+        trace.set_name('%s.%s' % (type(self).__name__, self.request.method.lower()))
+        webapp2.RequestHandler.dispatch(self)
+
+    def initialize(self, *a, **kw):
+        webapp2.RequestHandler.initialize(self, *a, **kw)
+        #self.can_post = self.user and self.user.name == 'spez'
+
+        if self.request.path.endswith('.json'):
+            self.format = 'json'
+        else:
+            self.format = 'html'
+    
+    def not_modified(self, path):
+        #Sets the ETag, Last-Modified and Cache-Control of a page view of path
+        #from cache.validators(), before anything is loaded or rendered.
+        #Returns True, with a 304, when the client's copy is still current.
+        v = cache.validators(path)
+        if not v:
+            return False
+        revision, stamp, versions, last_modified = v
+
+        #the document also depends on who is logged in and on the query (cursor...)
+        uid = self.read_secure_cookie('user_id') or ''
+        etag = '"%s"' % hashlib.md5(repr((revision, stamp, versions, uid, self.request.query_string))).hexdigest()
+        seconds = calendar.timegm(last_modified.utctimetuple())
+
+        self.response.headers['ETag'] = etag
+        self.response.headers['Last-Modified'] = formatdate(seconds, usegmt = True)
+        self.response.headers['Vary'] = 'Cookie'
+        if uid:
+            self.response.headers['Cache-Control'] = 'private, max-age=0, must-revalidate'
+        else:
+            self.response.headers['Cache-Control'] = 'public, max-age=%d' % ANONYMOUS_MAX_AGE
+
+        if_none_match = self.request.headers.get('If-None-Match')
+        if_modified_since = self.request.headers.get('If-Modified-Since')
+        if if_none_match:
+            fresh = if_none_match.strip() == '*' or etag in [t.strip() for t in if_none_match.split(',')]
+        elif if_modified_since:
+            t = parsedate_tz(if_modified_since)
+            fresh = t is not None and mktime_tz(t) >= seconds
+        else:
+            fresh = False
+
+        if fresh:
+            self.response.set_status(304)
+        return fresh
+
+    def notfound(self):
+        self.error(404)
+        self.write('<h1>404: Not Found</h1>Sorry, my friend but the page does not exist.')
@@ -0,0 +1,54 @@
+from lib import data
+
+from handlers.base import Handler
+
+
+class InboxPage(Handler):
+    def get(self):
+        if not self.user:
+            return self.redirect("/login")
+
+        entries, pager = data.Pager.fetch(data.InboxEntry.by_user(self.user.name),
+                                          self.request.get('cursor'), self.request.get('prev'),
+                                          data.INBOX_PER_PAGE)
+        self.render("inbox.html", entries = entries, pager = pager,
+                    unread = data.Inbox.unread_of(self.user.name))
+
+
+class ConversationPage(Handler):
+    #/conversation?u=<name>: the messages between the logged in user and u
+    def other(self):
+        name = self.request.get('u')
+        if not name or name == self.user.name:
+            return None
+        return data.User.by_name(name)
+
+    def get(self):
+        if not self.user:
+            return self.redirect("/login")
+
+        other = self.other()
+        if not other:
+            return self.notfound()
+
+        messages, pager = data.Pager.fetch(data.Dialogue.by_conversation(self.user.name, other.name),
+                                           self.request.get('cursor'), self.request.get('prev'),
+                                           data.MESSAGES_PER_PAGE, params = {'u': other.name})
+        data.InboxEntry.mark_read(self.user.name, other.name)
+
+        #the page holds the newest messages, shown oldest first
+        self.render("conversation-form.html", other = other, messages = messages[::-1], pager = pager)
+
+    def post(self):
+        if not self.user:
+            return self.redirect("/login")
+
+        other = self.other()
+        if not other:
+            return self.notfound()
+
+        content = self.request.get('content').strip()
+        if content:
+            data.Dialogue.send(self.user, other, content)
+
+        self.redirect("/conversation?u=" + other.name)
@@ -0,0 +1,12 @@
+from lib import fulltext
+
+from handlers.base import Handler
+
+
+class SearchPage(Handler):
+    def get(self):
+        q = self.request.get('q').strip()
+        results, pager = [], None
+        if q:
+            results, pager = fulltext.find(q, self.request.get('cursor'), self.request.get('prev'))
+        self.render("search.html", q = q, results = results, pager = pager)
@@ -0,0 +1,301 @@
+import json
+from datetime import datetime
+
+from google.appengine.ext import db
+
+from lib import data, cache, votes, trace, fulltext
+
+from handlers.base import Handler
+
+
+class EditPage(Handler):
+    def get(self, path):
+        if not self.user:
+            self.redirect('/login')
+        
+        v = self.request.get('v')
+        p = None
+        if v:
+            if v.isdigit():
+                p = data.Page.revision(int(v), path)
+                
+            if not p:
+                return self.notfound()
+                
+        else:
+            with trace.stage('page'):
+                p = data.PageHead.by_path(path)
+            
+        self.render("edit.html", path = path, page = p)
+
+    def post(self, path):
+        if not self.user:
+            self.error(400)
+            return
+            
+        content = self.request.get('content')
+        old_page = data.PageHead.by_path(path)
+        
+        #what to do when empty content is submitted?
+        if not (old_page or content):
+            return
+        elif not old_page or old_page.content != content:
+            head = data.Page.save(path, content)
+            cache.set_page(head)
+            data.SiteMap.touch(path, head.lastModified)
+            fulltext.index_page(head)
+            
+        self.redirect(path)
+        
+class HistoryPage(Handler):
+    def get(self, path):
+        if self.not_modified(path):
+            return
+        posts, pager = data.Pager.fetch(data.Page.by_path(path),
+                                        self.request.get('cursor'), self.request.get('prev'),
+                                        data.HISTORY_PER_PAGE)
+        data.Page.fill_content(path, posts)
+        if posts or pager.has_prev:
+            self.render("history.html", path = path, posts = posts, pager = pager)
+        else:
+            self.redirect("/_edit" + path)
+                
+        
+class ThreadHandler(Handler):
+    #the views of a comment thread answer <path>.json?since= with the comments
+    #created since, for the pages polling for new ones
+    def new_comments(self, path, under = None):
+        since = self.request.get('since')
+        comments, since = cache.comments_since(path, int(since) if since.isdigit() else None, under)
+        self.response.headers['Cache-Control'] = 'no-cache'
+        self.render_json(dict(comments = comments, since = since))
+
+    def poll_state(self, comments):
+        #where new-comments.html starts polling: now, with the keys of the
+        #comments shown that its first poll gets again (JSON)
+        since = data.micros(datetime.now())
+        seen = [str(c.key()) for c in comments if data.micros(c.created) > since - cache.POLL_OVERLAP]
+        return json.dumps(dict(since = since, seen = seen))
+
+
+class UserPage(ThreadHandler):
+    def get(self, path):
+        
+        path = "/user" + path
+        if self.format == 'json':
+            return self.new_comments(path)
+        v = self.request.get('v')
+        if not v and self.not_modified(path):
+            return
+        cursor, prev = self.request.get('cursor'), self.request.get('prev')
+        p = None
+        if v:
+            if v.isdigit():
+                p = data.Page.revision(int(v), path)
+                
+            if not p:
+                return self.notfound()
+                
+            with trace.stage('thread'):
+                comment_page = cache.thread(path, cursor, prev)
+        else:
+            #the page and the thread are read concurrently
+            with trace.stage('page_thread'):
+                p, comment_page = cache.page_and_thread(path, cursor, prev)
+        
+        with trace.stage('votes'):
+            votes.attach(comment_page)
+    
+        
+        if p:
+            self.render("user-form.html", page = p, path = path, comment_page = comment_page, pager = comment_page.pager,
+                        poll = self.poll_state(comment_page))
+        else:
+            self.redirect("/_edit" + path)
+
+    def post(self, path):
+        if not self.user:
+            return self.redirect("/login")
+        
+        path = "/user" + path
+        content = self.request.get('content')        
+        old_page = cache.page(path)
+        
+        #what to do when empty content is submitted?
+        if not (old_page or content):
+            return
+        elif not old_page or old_page.content != content:
+            c = data.Comment.new(path, content, self.user)
+            c.put()
+            cache.add_to_thread(path, c)
+            data.RecentComments.add(c)
+            fulltext.index_comment(c)
+            
+        #the page is read back from the caches that were just updated
+        self.redirect(path)
+
+        
+class WikiPage(ThreadHandler):
+    def get(self, path):
+        if self.format == 'json':
+            return self.new_comments(path)
+        
+        v = self.request.get('v')
+        if not v and self.not_modified(path):
+            return
+        
+        #anonymous viewers of the first page of the latest version all get the same document
+        anonymous = not (self.user or v or self.request.get('cursor'))
+        if anonymous:
+            html = cache.html(path, self.response.headers.get('ETag'))
+            if html:
+                return self.write(html)
+        
+        cursor, prev = self.request.get('cursor'), self.request.get('prev')
+        p = None
+        if v:
+            if v.isdigit():
+                p = data.Page.revision(int(v), path)
+                
+            if not p:
+                return self.notfound()
+                
+            with trace.stage('thread'):
+                comment_page = cache.thread(path, cursor, prev)
+        else:
+            #the page and the thread are read concurrently
+            with trace.stage('page_thread'):
+                p, comment_page = cache.page_and_thread(path, cursor, prev)
+        
+        with trace.stage('votes'):
+            votes.attach(comment_page)
+    
+        
+        if p:
+            html = self.render_str("page.html", page = p, path = path, comment_page = comment_page, pager = comment_page.pager,
+                                   poll = self.poll_state(comment_page))
+            if anonymous:
+                cache.set_html(path, html, self.response.headers.get('ETag'))
+            self.write(html)
+        else:
+            self.redirect("/_edit" + path)
+
+    def post(self, path):
+        if not self.user:
+            return self.redirect("/login")
+            
+        content = self.request.get('content')        
+        old_page = cache.page(path)
+        
+        #what to do when empty content is submitted?
+        if not (old_page or content):
+            return
+        elif not old_page or old_page.content != content:
+            c = data.Comment.new(path, content, self.user)
+            c.put()
+            cache.add_to_thread(path, c)
+            data.RecentComments.add(c)
+            fulltext.index_comment(c)
+            
+        #the page is read back from the caches that were just updated
+        self.redirect(path)
+
+
+class CommentPage(ThreadHandler):
+    def get(self, path):
+        
+        id = self.request.get('id')
+        if self.format == 'json' and not id.isdigit():
+            return self.error(400)
+        
+        p = None
+        if id:
+            if id.isdigit():
+                p = self.comment(path, int(id))
+                
+            if not p:
+                return self.notfound()           
+        
+        if not p:
+            return self.redirect("/_edit" + path)
+        
+        if self.format == 'json':
+            return self.new_comments(path, p.thread_path)
+        
+        #Get the answers at every depth, in display order
+        
+        with trace.stage('thread'):
+            answers, pager = data.Pager.fetch(p.subtree(),
+                                              self.request.get('cursor'), self.request.get('prev'),
+                                              params = p.link_params())
+            data.prefetch_authors(answers)
+        with trace.stage('votes'):
+            votes.attach([p] + answers)
+        
+        self.render("comment-form.html", path = path, c = p, answers = answers, pager = pager)
+
+    def post(self, path):
+        if not self.user:
+            self.error(400)
+            return
+            
+        content = self.request.get('content')        
+        
+        id = self.request.get('id')
+        
+        p = None
+        if id:
+            if id.isdigit():
+                p = self.comment(path, int(id))
+                
+            if not p:
+                return self.notfound()
+        
+        if not p:
+            return self.error(400)
+                
+        old_page = cache.page(path)
+        
+        #what to do when empty content is submitted?
+        if not (old_page or content):
+            return
+        elif not old_page or old_page.content != content:
+            c = data.Comment.new(path, content, self.user, reply_to = p)
+            c.put()
+            cache.add_to_thread(path, c)
+            data.RecentComments.add(c)
+            fulltext.index_comment(c)
+            
+        self.redirect(p.url())
+
+    def comment(self, path, id):
+        #answers stored under a top-level comment come with its id as ?root=
+        root = self.request.get('root')
+        return data.Comment.by_id(id, path, int(root) if root.isdigit() else None)
+
+
+class VotePage(Handler):
+    def post(self):
+        if not self.user:
+            return self.redirect("/login")
+
+        direction = self.request.get('dir')
+        try:
+            k = db.Key(self.request.get('k'))
+        except (db.BadArgumentError, db.BadKeyError):
+            k = None
+        if direction not in votes.DIRECTIONS or not k or k.kind() != 'Comment':
+            self.error(400)
+            return
+        #only stored comments are counted, other keys would create shards
+        try:
+            c = db.get(k)
+        except db.BadRequestError:
+            #a key of another app
+            c = None
+        if not c:
+            self.error(400)
+            return
+
+        votes.vote(str(k), self.user.key().id(), direction)
+        self.redirect(self.request.headers.get('referer', '/'))
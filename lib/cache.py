@@ -0,0 +1,311 @@
+import bisect
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from google.appengine.api import memcache
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import db
+
+from lib import data, fragments
+
+#rendered pages are also out of date when the sidebars (site map, recent
+#comments) change, which is not tracked per path: keep them for a short time
+HTML_TTL = 60
+
+#Values read from the datastore are cached with add(), so a reader that
+#queried before a concurrent write never replaces what the writer stored.
+#The writers only update a cached thread or tail, they do not create one:
+#a reader filling one after a write it missed would keep it stale, these
+#expire after FILL_TTL.
+FILL_TTL = 120
+
+CAS_RETRIES = 5
+
+##### hit/miss counters (per instance)
+_stats = defaultdict(int)
+_stats_lock = threading.Lock()
+
+def _count(name, hit):
+    with _stats_lock:
+        _stats['%s_%s' % (name, 'hit' if hit else 'miss')] += 1
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+##### serialization
+#entities are stored as encoded protocol buffers, which is both smaller and
+#faster to load than pickling db.Model instances
+def _dump(entities):
+    return [db.model_to_protobuf(e).Encode() for e in entities]
+
+def _load(values):
+    return [db.model_from_protobuf(entity_pb.EntityProto(v)) for v in values]
+
+def _set(key, value, time = 0):
+    #values over the memcache size limit are simply not cached
+    try:
+        return memcache.set(key, value, time = time)
+    except ValueError:
+        return False
+
+def _add(key, value, time = 0):
+    try:
+        return memcache.add(key, value, time = time)
+    except ValueError:
+        return False
+
+def _cas(client, key, value, time = 0):
+    try:
+        return client.cas(key, value, time = time)
+    except ValueError:
+        return False
+
+
+def page_key(path):
+    return 'page:' + path
+
+def thread_key(path):
+    return 'thread:' + path
+
+def html_key(path):
+    return 'html:' + path
+
+def stamp_key(path):
+    return 'stamp:' + path
+
+def tail_key(path):
+    return 'tail:' + path
+
+
+##### current revision (PageHead) per path
+def page(path):
+    v = memcache.get(page_key(path))
+    _count('page', v is not None)
+    if v is not None:
+        return _load([v])[0]
+
+    p = data.PageHead.by_path(path)
+    if p:
+        _add(page_key(path), _dump([p])[0])
+    return p
+
+def set_page(p):
+    #write-through after an edit
+    _set(page_key(p.pathPage), _dump([p])[0])
+    memcache.delete(html_key(p.pathPage))
+
+
+##### comment thread, only its first page is cached
+def _cached_thread(path, v):
+    comments = data.prefetch_authors(_load(v['comments']))
+    return data.CommentThread(path, comments, data.Pager(next_cursor = v['next_cursor']))
+
+def _load_thread(path):
+    t = data.CommentThread.load(path)
+    _add(thread_key(path), dict(comments = _dump(t.comments),
+                                paths = [c.thread_path for c in t.comments],
+                                roots = len(t.roots()),
+                                next_cursor = t.pager.next_cursor),
+         time = FILL_TTL)
+    return t
+
+def thread(path, cursor = None, prev = None):
+    if cursor:
+        return data.CommentThread.load(path, cursor, prev)
+
+    v = memcache.get(thread_key(path))
+    _count('thread', v is not None)
+    if v is not None:
+        return _cached_thread(path, v)
+    return _load_thread(path)
+
+
+##### both, for the page views
+def page_and_thread(path, cursor = None, prev = None):
+    #The current page and a page of its comment thread, as page() and
+    #thread() give them, without waiting for one before asking for the
+    #other: both cache entries come from one memcache call, and on misses the
+    #get of the head runs while the thread is queried.
+    keys = [page_key(path)] + ([] if cursor else [thread_key(path)])
+    cached = memcache.get_multi(keys)
+
+    _count('page', page_key(path) in cached)
+    head = None
+    if page_key(path) in cached:
+        p = _load([cached[page_key(path)]])[0]
+    else:
+        head = data.PageHead.by_path_async(path)
+
+    if cursor:
+        t = data.CommentThread.load(path, cursor, prev)
+    else:
+        _count('thread', thread_key(path) in cached)
+        if thread_key(path) in cached:
+            t = _cached_thread(path, cached[thread_key(path)])
+        else:
+            t = _load_thread(path)
+
+    if head:
+        p = head()
+        if p:
+            _add(page_key(path), _dump([p])[0])
+    return p, t
+
+def invalidate_thread(path):
+    touch_thread(path)
+    memcache.delete_multi([thread_key(path), html_key(path)])
+
+def add_to_thread(path, c):
+    #Adds a new comment or answer to the cached first page, at its place in
+    #thread_path order, instead of dropping it, so the page the writer is
+    #redirected to is still a cache hit. A comment that belongs on a later
+    #page is left out; a top-level comment that would overflow the first
+    #page drops the cached page instead.
+    touch_thread(path)
+    add_to_tail(path, c)
+    memcache.delete(html_key(path))
+    client = memcache.Client()
+    for i in xrange(CAS_RETRIES):
+        v = client.gets(thread_key(path))
+        if v is None:
+            return
+        if 'paths' not in v:
+            #cached before comments were threaded
+            return invalidate_thread(path)
+
+        if v['next_cursor'] and c.thread_path >= v['next_cursor']:
+            return
+        if c.comment_level == 1:
+            if v['roots'] >= data.COMMENTS_PER_PAGE:
+                return invalidate_thread(path)
+            v['roots'] += 1
+        i = bisect.bisect(v['paths'], c.thread_path)
+        v['comments'].insert(i, _dump([c])[0])
+        v['paths'].insert(i, c.thread_path)
+
+        if _cas(client, thread_key(path), v, time = FILL_TTL):
+            return
+    invalidate_thread(path)
+
+
+##### rendered html for anonymous viewers
+#Kept with the ETag it was rendered under (see Handler.not_modified) and
+#only served under the same one: votes and the sidebars change the ETag
+#without dropping the cached copy.
+def html(path, etag):
+    v = memcache.get(html_key(path))
+    hit = isinstance(v, tuple) and bool(etag) and v[0] == etag
+    _count('html', hit)
+    return v[1] if hit else None
+
+def set_html(path, s, etag):
+    if etag:
+        _set(html_key(path), (etag, s), time = HTML_TTL)
+
+
+##### validators of the page views (ETag, Last-Modified)
+#The time the comments of a path (or their votes) last changed. When it was
+#evicted it starts again from now: clients holding an older copy get it
+#again once, nobody gets a stale one.
+def touch_thread(path):
+    memcache.set(stamp_key(path), time.time())
+
+def validators(path):
+    #(revision of the head, time of the last comment change, versions of the
+    #sidebar fragments, last modified datetime), or None when path has no
+    #page. One memcache call when everything is cached, the thread itself is
+    #never read.
+    sidebars = [fragments.SITE_MAP, fragments.RECENT]
+    keys = [page_key(path), stamp_key(path)] + [fragments.version_key(f) for f in sidebars]
+    cached = memcache.get_multi(keys)
+
+    if page_key(path) in cached:
+        p = _load([cached[page_key(path)]])[0]
+    else:
+        p = page(path)
+    if not p:
+        return None
+
+    stamp = cached.get(stamp_key(path))
+    if stamp is None:
+        stamp = time.time()
+        if not memcache.add(stamp_key(path), stamp):
+            stamp = memcache.get(stamp_key(path)) or stamp
+    versions = [cached.get(fragments.version_key(f)) or fragments.version(f) for f in sidebars]
+
+    last_modified = max(p.lastModified, datetime.utcfromtimestamp(stamp))
+    return p.revision, stamp, versions, last_modified
+
+
+##### newest comments of a path, for polling
+#The last data.THREAD_TAIL_SIZE comments and answers of a path as the JSON
+#API returns them, in creation order, with 'complete' when they are the
+#whole thread. Clients ask for what was created after the 'since' of the
+#last item they got (microseconds since the epoch). A comment reaches the
+#tail when it is put, a little after its creation time, possibly after a
+#later one: each poll also returns the last POLL_OVERLAP microseconds
+#before since, clients drop the keys they already have.
+POLL_OVERLAP = 30 * 1000000
+
+def tail_entry(c):
+    reply_to = data.Comment.reply_to.get_value_for_datastore(c)
+    return dict(id = c.key().id(),
+                reply_to = reply_to and reply_to.id(),
+                level = c.comment_level,
+                thread_path = c.thread_path,
+                key = str(c.key()),
+                author = data.author_name(c),
+                content = c.content,
+                created = c.created.isoformat(),
+                since = data.micros(c.created))
+
+def _load_tail(path):
+    comments, complete = data.latest_comments(path)
+    v = dict(items = [tail_entry(c) for c in data.prefetch_authors(comments)],
+             complete = complete)
+    _add(tail_key(path), v, time = FILL_TTL)
+    return v
+
+def add_to_tail(path, c):
+    e = tail_entry(c)
+    client = memcache.Client()
+    for i in xrange(CAS_RETRIES):
+        v = client.gets(tail_key(path))
+        if v is None:
+            #rebuilt by the next poll
+            return
+        items = v['items']
+        items.insert(bisect.bisect([x['since'] for x in items], e['since']), e)
+        if len(items) > data.THREAD_TAIL_SIZE:
+            items = items[-data.THREAD_TAIL_SIZE:]
+            v['complete'] = False
+        v['items'] = items
+        if _cas(client, tail_key(path), v, time = FILL_TTL):
+            return
+    memcache.delete(tail_key(path))
+
+def comments_since(path, since, under = None):
+    #(tail entries of path created after since - POLL_OVERLAP (None for the
+    #whole tail), only the answers under the thread_path under if given; the
+    #since of the next poll).
+    #Read from the datastore when the client is further behind than the
+    #cached tail, a page of THREAD_TAIL_SIZE at a time.
+    v = memcache.get(tail_key(path))
+    _count('tail', v is not None)
+    if v is None or (v['items'] and 'thread_path' not in v['items'][0]):
+        #missing, or cached before comments were threaded
+        v = _load_tail(path)
+
+    after = since - POLL_OVERLAP if since is not None else None
+    items = v['items']
+    if after is not None and not v['complete'] and items and items[0]['since'] > after:
+        items = [tail_entry(c) for c in data.prefetch_authors(data.comments_since(path, data.from_micros(after)))]
+
+    items = [e for e in items if after is None or e['since'] > after]
+    next_since = max([since] + [e['since'] for e in items[-1:]])
+    return ([e for e in items if under is None or (e['thread_path'] > under and e['thread_path'].startswith(under))],
+            next_since)
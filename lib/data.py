@@ -1,11 +1,19 @@
         
+import calendar
 import random
 import string
 import hashlib
+import json
+import urllib
 from string import letters
+from datetime import datetime
+from collections import namedtuple
 
 from google.appengine.ext import db
 from google.appengine.api import memcache
+
+from lib.delta import make as make_delta, apply as apply_delta
+from lib import fragments
  
 ##### user stuff
 def make_salt(length = 5):
@@ -35,8 +43,22 @@ class User(db.Model):
 
     @classmethod
     def by_name(cls, name):
-        u = cls.all().filter('name =', name).get()
-        return u
+        uid = memcache.get(UserName.cache_key(name))
+        if uid is None:
+            n = UserName.get(UserName.key_for(name))
+            if n:
+                uid = n.user_id
+            elif Migrated.done(USER_NAMES_MIGRATION):
+                return None
+            else:
+                #users created before UserName existed, until
+                #migration.user_names() has claimed all their names
+                u = cls.all().ancestor(users_key()).filter('name =', name).get()
+                if not u:
+                    return None
+                uid = UserName.claim(u).user_id
+            memcache.set(UserName.cache_key(name), uid)
+        return cls.by_id(uid)
 
     @classmethod
     def register(cls, name, pw, email = None):
@@ -46,6 +68,23 @@ class User(db.Model):
                     pw_hash = pw_hash,
                     email = email)
 
+    @classmethod
+    def create(cls, name, pw, email = None):
+        #Registers and stores a user if the name is free, in one transaction
+        #on the users entity group. Returns None when the name is taken.
+        def txn():
+            if UserName.get(UserName.key_for(name)):
+                return None
+            u = cls.register(name, pw, email)
+            u.put()
+            UserName.claim(u)
+            return u
+
+        u = db.run_in_transaction(txn)
+        if u:
+            memcache.set(UserName.cache_key(name), u.key().id())
+        return u
+
     @classmethod
     def login(cls, name, pw):
         u = cls.by_name(name)
@@ -53,9 +92,72 @@ class User(db.Model):
             return u
 
 
-            
+
+class UserName(db.Model):
+    #The id of the user with a given name, keyed by that name in the users
+    #entity group: finding a user by name is a get by key, and signup can
+    #check and claim a name in the same transaction as the User put.
+    user_id = db.IntegerProperty(required = True)
+
+    @staticmethod
+    def key_for(name):
+        return db.Key.from_path('UserName', name, parent = users_key())
+
+    @staticmethod
+    def cache_key(name):
+        return 'username:' + name
+
+    @classmethod
+    def claim(cls, u):
+        n = cls(key = cls.key_for(u.name), user_id = u.key().id())
+        n.put()
+        return n
+
+
+
+#the name of the migration.user_names() Migrated flag
+USER_NAMES_MIGRATION = 'user_names'
+
+class Migrated(db.Model):
+    #Stored, keyed by its name, once a one-shot migration has finished: code
+    #still reading the old layout checks it before doing so. The flag never
+    #goes away, so an instance remembers it once seen.
+    finished = db.DateTimeProperty(auto_now_add = True)
+    seen = set()
+
+    @staticmethod
+    def cache_key(name):
+        return 'migrated:' + name
+
+    @classmethod
+    def done(cls, name):
+        if name in cls.seen:
+            return True
+        if memcache.get(cls.cache_key(name)) or cls.get_by_key_name(name):
+            memcache.set(cls.cache_key(name), True)
+            cls.seen.add(name)
+            return True
+        return False
+
+    @classmethod
+    def finish(cls, name):
+        cls(key_name = name).put()
+        memcache.set(cls.cache_key(name), True)
+
+
+
+#a revision out of KEYFRAME_EVERY keeps its full content, so rebuilding an old
+#revision never applies more than that many deltas
+KEYFRAME_EVERY = 20
+
 class Page(db.Model):
-    content = db.TextProperty(required = True)
+    #One revision of a page. The current one holds its full content; when it
+    #is replaced the previous one is stored as a delta against it (content
+    #is None, delta is set) unless it is a keyframe. Revisions written before
+    #deltas existed all have their content and no number.
+    content = db.TextProperty(required = False)
+    delta = db.TextProperty(required = False)
+    number = db.IntegerProperty(required = False)
     created = db.DateTimeProperty(auto_now_add = True)
     lastModified = db.DateTimeProperty(auto_now = True)
     pathPage = db.StringProperty(required = False)
@@ -74,134 +176,702 @@ class Page(db.Model):
     @classmethod
     def by_id(cls, page_id, path):
         return cls.get_by_id(page_id, cls.parent_key(path))
-                   
- 
+
+    @classmethod
+    def revision(cls, page_id, path):
+        p = cls.by_id(page_id, path)
+        return p and cls.fill_content(path, [p])[0]
+
+    @classmethod
+    def fill_content(cls, path, revisions):
+        #Rebuilds the content of consecutive revisions (newest first) stored
+        #as deltas, starting from the closest newer revision with its content.
+        if all(r.content is not None for r in revisions):
+            return revisions
+
+        base = u''
+        if revisions[0].content is None:
+            q = cls.all().ancestor(cls.parent_key(path))
+            q.filter('created >', revisions[0].created).order('created')
+            newer = []
+            for r in q.run(batch_size = KEYFRAME_EVERY):
+                newer.append(r)
+                if r.content is not None:
+                    break
+            if newer:
+                base = newer.pop().content
+            for r in reversed(newer):
+                base = apply_delta(base, r.delta)
+
+        for r in revisions:
+            if r.content is None:
+                r.content = apply_delta(base, r.delta)
+            base = r.content
+        return revisions
+
+    @classmethod
+    def save(cls, path, content):
+        #Writes a new revision and moves the head to it, in one transaction on
+        #the page's entity group.
+        def txn():
+            head = PageHead.get(PageHead.key_for(path))
+            number = head and head.number and head.number + 1 or 1
+
+            p = cls(parent = cls.parent_key(path), content = content, pathPage = path, number = number)
+            p.put()
+
+            old = head and cls.by_id(head.revision, path)
+            if old and old.content is not None and old.number and old.number % KEYFRAME_EVERY:
+                d = make_delta(content, old.content)
+                if len(d) < len(old.content):
+                    old.delta = d
+                    old.content = None
+                    old.put()
+
+            head = PageHead.from_revision(p)
+            head.put()
+            return head
+
+        return db.run_in_transaction(txn)
+
+
+
+class PageHead(db.Model):
+    #The current revision of a path with its content, at a fixed key in the
+    #page's entity group: the current page is a get by key instead of a sort
+    #over every revision.
+    content = db.TextProperty(required = True)
+    revision = db.IntegerProperty(required = True)
+    number = db.IntegerProperty(required = False)
+    pathPage = db.StringProperty(required = False)
+    created = db.DateTimeProperty()
+    lastModified = db.DateTimeProperty(auto_now = True)
+
+    @staticmethod
+    def key_for(path):
+        return db.Key.from_path('PageHead', 'head', parent = Page.parent_key(path))
+
+    @classmethod
+    def from_revision(cls, p):
+        path = p.key().parent().name()
+        return cls(key = cls.key_for(path),
+                   content = p.content,
+                   revision = p.key().id(),
+                   number = p.number,
+                   pathPage = path,
+                   created = p.created)
+
+    @classmethod
+    def by_path_async(cls, path):
+        #starts the get of the head, the returned function waits for it
+        rpc = db.get_async(cls.key_for(path))
+        def result():
+            return rpc.get_result() or cls.by_path(path)
+        return result
+
+    @classmethod
+    def by_path(cls, path):
+        head = cls.get(cls.key_for(path))
+        if head is None:
+            #page written before heads existed; in a transaction on the
+            #page's group, a concurrent Page.save may have written one
+            def txn():
+                head = cls.get(cls.key_for(path))
+                if head is None:
+                    p = Page.by_path(path).get()
+                    if p:
+                        head = cls.from_revision(p)
+                        head.put()
+                return head
+            head = db.run_in_transaction(txn)
+        return head
+
+
+
+#one line of the "Plan du site"
+SiteMapEntry = namedtuple('SiteMapEntry', ['pathPage', 'lastModified'])
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+class SiteMap(db.Model):
+    #Every distinct page path with the time of its last edit, in a single
+    #entity updated on each edit, so the sidebar no longer goes through all
+    #the revisions stored as Page entities.
+    entries = db.TextProperty()
+
+    KEY_NAME = 'default'
+    CACHE_KEY = 'sitemap'
+
+    def as_dict(self):
+        return json.loads(self.entries) if self.entries else {}
+
+    def pages(self):
+        return [SiteMapEntry(path, datetime.strptime(t, TIME_FORMAT))
+                for path, t in sorted(self.as_dict().iteritems())]
+
+    @classmethod
+    def touch(cls, path, last_modified):
+        #a site map created here would only hold path
+        if not cls.get_by_key_name(cls.KEY_NAME):
+            cls.rebuild()
+
+        def txn():
+            m = cls.get_by_key_name(cls.KEY_NAME)
+            d = m.as_dict()
+            d[path] = last_modified.strftime(TIME_FORMAT)
+            m.entries = json.dumps(d)
+            m.put()
+
+        #dropped rather than set: two touch() calls could set their copies
+        #in the other order than they committed
+        db.run_in_transaction(txn)
+        memcache.delete(cls.CACHE_KEY)
+        fragments.bump(fragments.SITE_MAP)
+
+    @classmethod
+    def rebuild(cls):
+        #One pass over every revision, only needed once for the pages written
+        #before the site map existed. Stored only if there is still no site
+        #map, a concurrent touch() or rebuild() wins.
+        d = {}
+        for p in Page.all().run(batch_size = 1000):
+            if p.pathPage and (p.pathPage not in d or d[p.pathPage] < p.lastModified):
+                d[p.pathPage] = p.lastModified
+
+        entries = json.dumps(dict((path, t.strftime(TIME_FORMAT)) for path, t in d.iteritems()))
+
+        def txn():
+            m = cls.get_by_key_name(cls.KEY_NAME)
+            if not m:
+                m = cls(key_name = cls.KEY_NAME, entries = entries)
+                m.put()
+            return m
+        return db.run_in_transaction(txn)
+
+    @classmethod
+    def all_pages(cls):
+        pages = memcache.get(cls.CACHE_KEY)
+        if pages is None:
+            m = cls.get_by_key_name(cls.KEY_NAME) or cls.rebuild()
+            pages = m.pages()
+            memcache.add(cls.CACHE_KEY, pages)
+        return pages
+
+
+
+#Where comments are stored:
+#  'page'    every comment and answer of a path in the ('comments', path)
+#            entity group, read with ancestor queries. Strongly consistent,
+#            but all the writes of a page share one entity group.
+#  'thread'  each top-level comment is the root of its own entity group and
+#            its answers, at any depth, are its children. The thread of a
+#            path is read from the pathPage index, which also finds the
+#            comments stored with the 'page' layout, and may miss a comment
+#            for a moment after it is written.
+#Either way an answer goes in the entity group of the comment it answers.
+COMMENT_LAYOUT = 'page'
+
+def comments_root(path):
+    return db.Key.from_path('comments', path)
+
+def micros(dt):
+    #microseconds since the epoch of a naive UTC datetime
+    return calendar.timegm(dt.utctimetuple()) * 1000000 + dt.microsecond
+
+def from_micros(n):
+    return datetime.utcfromtimestamp(n // 1000000).replace(microsecond = n % 1000000)
+
+
+#Comments are threaded with a materialized path: thread_path is the
+#thread_path of the comment answered followed by a segment of its own, the
+#creation time in hex and a few random bits for comments created in the same
+#microsecond. Sorting on thread_path gives the tree in display order, each
+#comment followed by its answers, so a whole thread or the answers under a
+#comment are one range query. comment_level is the depth, 1 at the top.
+MAX_DEPTH = 20
+
+def thread_segment(created):
+    return '%014x%04x/' % (micros(created), random.getrandbits(16))
 
 class Comment(db.Model):
     content = db.TextProperty(required = True)
     author = db.ReferenceProperty(User, required = False)
+    author_name = db.StringProperty(required = False)
     pathPage = db.StringProperty(Page, required = False)
     created = db.DateTimeProperty(auto_now_add = True)
     lastModified = db.DateTimeProperty(auto_now = True)
     upVotes = db.IntegerProperty(default=0, required = False)
     downVotes = db.IntegerProperty(default=0, required = False)
     comment_level =  db.IntegerProperty(default=1, required = False)
+    thread_path = db.StringProperty(required = False)
+    reply_to = db.SelfReferenceProperty(collection_name = 'answers')
    
     @staticmethod
     def parent_key(path):
-        return db.Key.from_path('comments', path)
+        #of the top-level comments
+        if COMMENT_LAYOUT == 'thread':
+            return None
+        return comments_root(path)
+
+    @classmethod
+    def new(cls, path, content, author, reply_to = None):
+        #A comment of path, or an answer to the Comment reply_to, not put yet.
+        #Past MAX_DEPTH an answer goes next to the comment it answers.
+        if reply_to and reply_to.comment_level >= MAX_DEPTH:
+            reply_to = reply_to.reply_to
+
+        created = datetime.now()
+        if reply_to:
+            parent, level, prefix = reply_to.thread_root(), reply_to.comment_level + 1, reply_to.thread_path
+        else:
+            parent, level, prefix = cls.parent_key(path), 1, ''
+        return cls(parent = parent,
+                   content = content,
+                   author = author,
+                   author_name = author and author.name,
+                   pathPage = path,
+                   created = created,
+                   comment_level = level,
+                   thread_path = prefix + thread_segment(created),
+                   reply_to = reply_to)
+
+    def thread_root(self):
+        #the key of the entity group the comment is in
+        k = self.key()
+        while k.parent():
+            k = k.parent()
+        return k
+
+    def link_params(self):
+        #the query of the comment's page; the answers stored under a
+        #top-level comment ('thread' layout) are found with its id as root
+        params = [('id', self.key().id())]
+        parent = self.key().parent()
+        if parent and parent.kind() == 'Comment':
+            params.append(('root', parent.id()))
+        return params
+
+    def url(self):
+        return '/comment%s?%s' % (self.pathPage, urllib.urlencode(self.link_params()))
+
+    def subtree(self):
+        #the answers under the comment at every depth, in display order
+        q = Comment.all()
+        q.ancestor(self.thread_root())
+        q.filter('thread_path >', self.thread_path)
+        q.filter('thread_path <', self.thread_path + u'\ufffd')
+        q.order('thread_path')
+        return q
                 
     @classmethod
-    def by_path(cls, path):
+    def by_path(cls, path, order = "created"):
         q = cls.all()
-        q.ancestor(cls.parent_key(path))
-        q.order("created")
+        if COMMENT_LAYOUT == 'thread':
+            q.filter('pathPage =', path)
+        else:
+            q.ancestor(comments_root(path))
+        q.order(order)
+        return q
+
+    @classmethod
+    def tree(cls, path, start = None):
+        #the comments of path in display order, from the thread_path start
+        q = cls.by_path(path, 'thread_path')
+        if start:
+            q.filter('thread_path >=', start)
         return q
     
     @classmethod
-    def by_id(cls, page_id, path):
-        return cls.get_by_id(page_id, cls.parent_key(path))      
+    def by_id(cls, page_id, path, root_id = None):
+        if root_id:
+            c = cls.get_by_id(page_id, db.Key.from_path('Comment', root_id))
+            return c if c and c.pathPage == path else None
 
+        c = cls.get_by_id(page_id, cls.parent_key(path))
+        if COMMENT_LAYOUT == 'thread':
+            if c and c.pathPage != path:
+                c = None
+            if not c:
+                c = cls.get_by_id(page_id, comments_root(path))
+        return c
 
 
 class SubComment(db.Model):
+    #Answers stored before comments were threaded, only read by
+    #lib.migration. migrated_to is the key of the Comment replacing it.
     content = db.TextProperty(required = True)
     parent_comment = db.ReferenceProperty(Comment, required = False)
     author = db.ReferenceProperty(User, required = False)
+    author_name = db.StringProperty(required = False)
     pathPage = db.StringProperty(Page, required = False)
     created = db.DateTimeProperty(auto_now_add = True)
     lastModified = db.DateTimeProperty(auto_now = True)
     upVotes = db.IntegerProperty(default=0, required = False)
     downVotes = db.IntegerProperty(default=0, required = False)
     comment_level =  db.IntegerProperty(default=2, required = False)
-   
-    @staticmethod
-    def parent_key(path):
-        return db.Key.from_path('comments', path)
-        
-    @staticmethod
-    def parent_comment_key(path, c_id):
-        return db.Key.from_path('comments', path, 'comments', c_id)
-        
-    @classmethod
-    def by_path(cls, path):
-        q = cls.all()
-        q.ancestor(cls.parent_key(path))
-        q.order("created")
-        return q
-    
+    migrated_to = db.StringProperty(required = False)
+
+
+
+def prefetch_authors(comments):
+    #Resolves the authors of Comments with one batch get, so that
+    #c.author.name in the templates does not fetch the users one at a time.
+    #Comments written with their author_name don't need it and are skipped.
+    todo = [(c, c.__class__.author.get_value_for_datastore(c))
+            for c in comments if not c.author_name]
+    keys = set(k for c, k in todo if k)
+    if not keys:
+        return comments
+
+    authors = dict((u.key(), u) for u in db.get(list(keys)) if u)
+    for c, k in todo:
+        if k in authors:
+            c.author = authors[k]
+    return comments
+
+def author_name(c):
+    return c.author_name or (c.author and c.author.name) or ''
+
+def preview(content, length):
+    #the start of content shown in a list; one character more than length
+    #is kept, enough to know it was cut
+    return content[:length + 1]
+
+
+#comments of a path by creation time, for the "new comments" polling of the
+#page views
+THREAD_TAIL_SIZE = 100
+
+def latest_comments(path, n = THREAD_TAIL_SIZE):
+    #(the newest n comments of path, oldest first, whether they are all there is)
+    comments = Comment.by_path(path, "-created").fetch(n)
+    return comments[::-1], len(comments) < n
+
+def comments_since(path, after, n = THREAD_TAIL_SIZE):
+    #the first n comments of path created after the datetime after
+    return Comment.by_path(path).filter('created >', after).fetch(n)
+
+
+
+##### pagination
+COMMENTS_PER_PAGE = 50
+HISTORY_PER_PAGE = 20
+
+class Pager(object):
+    #Position of one page of a query, from the datastore cursor given in
+    #?cursor=. The cursors of the pages already seen travel in ?prev= so the
+    #"previous" link doesn't need a reversed query; only the last MAX_BACK are
+    #kept, past that it goes back to the first page.
+    MAX_BACK = 10
+
+    def __init__(self, cursor = '', prev = None, next_cursor = None, params = None):
+        self.cursor = cursor or ''
+        self.prev = prev or []
+        self.next_cursor = next_cursor
+        #other query parameters the links must keep (e.g. the comment id)
+        self.params = params or {}
+
     @classmethod
-    def by_path_comment(cls, path, c_id):
-        q = cls.all()
-        q.ancestor(cls.parent_comment_key(path, c_id))
-        q.order("created")
-        return q
-        
+    def fetch(cls, q, cursor = None, prev = None, size = COMMENTS_PER_PAGE, params = None):
+        prev = prev.split(',') if prev else []
+        items = None
+        if cursor:
+            #a cursor that doesn't decode fails in with_cursor(), one from
+            #another query only when fetching: both show the first page
+            try:
+                q.with_cursor(cursor)
+                items = q.fetch(size)
+            except (db.BadValueError, db.BadArgumentError, db.BadRequestError):
+                q.with_cursor(None)
+                cursor, prev = None, []
+
+        if items is None:
+            items = q.fetch(size)
+        next_cursor = q.cursor() if len(items) == size else None
+        return items, cls(cursor, prev, next_cursor, params)
+
+    @property
+    def has_prev(self):
+        return bool(self.cursor)
+
+    @property
+    def has_next(self):
+        return bool(self.next_cursor)
+
+    def _query(self, cursor, prev):
+        params = dict(self.params)
+        if cursor:
+            params['cursor'] = cursor
+        if prev:
+            params['prev'] = ','.join(prev[-self.MAX_BACK:])
+        return urllib.urlencode(params)
+
+    def next_query(self):
+        return self._query(self.next_cursor, self.prev + [self.cursor])
+
+    def prev_query(self):
+        return self._query(self.prev and self.prev[-1], self.prev[:-1])
+
+
+
+#number of entities pulled per datastore round trip when loading a thread
+THREAD_BATCH_SIZE = 1000
+
+class CommentThread(object):
+    #One page of the comment tree of a path: size top-level comments with
+    #all their answers, in display order, read with one range query on
+    #thread_path. The cursor of a page is the thread_path of its first
+    #comment. Iterating gives the comments in display order.
+
+    def __init__(self, path, comments, pager = None):
+        self.path = path
+        self.comments = comments
+        self.pager = pager or Pager()
+
     @classmethod
-    def by_id(cls, page_id, path):
-        return cls.get_by_id(page_id, cls.parent_key(path))        
+    def load(cls, path, cursor = None, prev = None, size = COMMENTS_PER_PAGE):
+        prev = prev.split(',') if prev else []
+        comments = []
+        roots = 0
+        next_cursor = None
+        for c in Comment.tree(path, cursor).run(batch_size = THREAD_BATCH_SIZE):
+            if c.comment_level == 1:
+                if roots == size:
+                    next_cursor = c.thread_path
+                    break
+                roots += 1
+            comments.append(c)
 
+        prefetch_authors(comments)
+        return cls(path, comments, Pager(cursor, prev, next_cursor))
 
+    def roots(self):
+        return [c for c in self.comments if c.comment_level == 1]
 
-class Conversation(db.Model):
+    def __iter__(self):
+        return iter(self.comments)
+
+    def __len__(self):
+        return len(self.comments)
+
+
+
+##### votes
+VOTE_SHARDS = 20
+
+class VoteShard(db.Model):
+    #Part of the vote counts of one Comment. Each shard is its
+    #own entity group, so votes are not serialized through the comments
+    #entity group of the page. Keyed by '<comment key>|<shard>'.
+    target = db.StringProperty(required = True)
+    up = db.IntegerProperty(default = 0)
+    down = db.IntegerProperty(default = 0)
 
-    pathPage = db.StringProperty(required = False)
-    user1 = db.StringProperty(required = True)    
-    user2 = db.StringProperty(required = True)    
-    
     @staticmethod
-    def parent_key(path):
-        return db.Key.from_path('conversation', path)
-        
+    def key_for(target, shard):
+        return db.Key.from_path('VoteShard', '%s|%d' % (target, shard))
+
+class VoteTotal(db.Model):
+    #Sum of the shards of a comment, refreshed when the votes buffered in
+    #memcache are flushed. Keyed by the comment key.
+    up = db.IntegerProperty(default = 0)
+    down = db.IntegerProperty(default = 0)
+
     @staticmethod
-    def parent_conversation_key(path, c_id):
-        return db.Key.from_path('conversation', path, 'conversation', c_id)
-            
+    def key_for(target):
+        return db.Key.from_path('VoteTotal', target)
+
+class Vote(db.Model):
+    #The vote of one user on one comment, keyed by '<comment key>|<user id>',
+    #so a user is counted once per comment. Its own entity group, like the
+    #shards.
+    direction = db.StringProperty(required = True)
+
+    @staticmethod
+    def key_for(target, voter):
+        return db.Key.from_path('Vote', '%s|%d' % (target, voter))
+
+
+
+#size of the recent comments feed, the sidebar shows the first ones
+RECENT_COMMENTS_SIZE = 50
+RECENT_COMMENTS_SHOWN = 10
+RECENT_PREVIEW_LENGTH = 50
+
+class RecentComments(object):
+    #The last comments of the whole site, with the author name and the path
+    #copied in, kept as a bounded list in memcache and updated when a comment
+    #is written. The datastore is only queried to rebuild it after an eviction.
+    CACHE_KEY = 'recent-comments'
+    CAS_RETRIES = 5
+
+    @staticmethod
+    def entry(c):
+        return dict(key = str(c.key()),
+                    author_name = author_name(c),
+                    pathPage = c.pathPage,
+                    content = preview(c.content, RECENT_PREVIEW_LENGTH))
+
     @classmethod
-    def by_path_conversation(cls, path, c_id):
-        q = cls.all()
-        q.ancestor(cls.parent_comment_key(path, c_id))
-        q.order("created")
-        return q
-        
+    def rebuild(cls):
+        comments = Comment.all().order('-created').fetch(RECENT_COMMENTS_SIZE)
+        entries = [cls.entry(c) for c in prefetch_authors(comments)]
+        memcache.set(cls.CACHE_KEY, entries)
+        return entries
+
     @classmethod
-    def by_id(cls, page_id, path):
-        return cls.get_by_id(page_id, cls.parent_key(path))        
+    def add(cls, c):
+        cls._add(cls.entry(c))
+        fragments.bump(fragments.RECENT)
 
+    @classmethod
+    def _add(cls, e):
+        client = memcache.Client()
+        for i in xrange(cls.CAS_RETRIES):
+            entries = client.gets(cls.CACHE_KEY)
+            if entries is None:
+                #evicted, the next read rebuilds it from the datastore
+                return
+            entries = [e] + [x for x in entries if x['key'] != e['key']]
+            if client.cas(cls.CACHE_KEY, entries[:RECENT_COMMENTS_SIZE]):
+                return
+        memcache.delete(cls.CACHE_KEY)
 
+    @classmethod
+    def latest(cls, n = RECENT_COMMENTS_SHOWN):
+        entries = memcache.get(cls.CACHE_KEY)
+        if entries is None:
+            entries = cls.rebuild()
+        return entries[:n]
 
-class Dialogue(db.Model):
 
-    content = db.TextProperty(required = True)
+
+##### private messages
+MESSAGES_PER_PAGE = 50
+INBOX_PER_PAGE = 50
+#characters of the last message the inbox shows
+PREVIEW_LENGTH = 100
+
+def inbox_root(name):
+    return db.Key.from_path('Inbox', name)
+
+class Conversation(db.Model):
+    #The private messages between two users, keyed by their names in sorted
+    #order: the conversation of a pair is found by key, and created with its
+    #first message, never looked up with a query. Its messages (Dialogue)
+    #are its children.
+    user1 = db.StringProperty(required = True)
+    user2 = db.StringProperty(required = True)
     created = db.DateTimeProperty(auto_now_add = True)
     lastModified = db.DateTimeProperty(auto_now = True)
-    author = db.ReferenceProperty(User, required = True)
-    conversation = db.ReferenceProperty(Conversation, required = True)
-    
-   
-    @staticmethod
-    def parent_dialogue_key(path, c_id):
-        return db.Key.from_path('conversation', path, 'conversation', c_id)
-            
-    @classmethod
-    def by_path_dialogue(cls, path, c_id):
-        q = cls.all()
-        q.ancestor(cls.parent_dialogue_key(path, c_id))
-        q.order("created")
-        return q
-        
-    @classmethod
-    def by_id(cls, page_id, path):
-        return cls.get_by_id(page_id, cls.parent_key(path))      
+    messages = db.IntegerProperty(default = 0)
 
+    @staticmethod
+    def key_for(name, other):
+        user1, user2 = sorted([name, other])
+        return db.Key.from_path('Conversation', '%s|%s' % (user1, user2))
 
+    def other(self, name):
+        return self.user2 if name == self.user1 else self.user1
 
 
 
+class Dialogue(db.Model):
+    #One private message, in the entity group of its Conversation.
+    content = db.TextProperty(required = True)
+    created = db.DateTimeProperty(auto_now_add = True)
+    lastModified = db.DateTimeProperty(auto_now = True)
+    author = db.ReferenceProperty(User, required = True)
+    author_name = db.StringProperty(required = False)
 
+    @classmethod
+    def by_conversation(cls, name, other):
+        #newest first, the history is paged backwards
+        q = cls.all()
+        q.ancestor(Conversation.key_for(name, other))
+        q.order('-created')
+        return q
 
+    @classmethod
+    def send(cls, author, to, content):
+        #Stores a message from the User author to the User to, with the
+        #Conversation on the first one, and updates the inbox entries of
+        #both users and the unread total of to in the same cross-group
+        #transaction: three entity groups, one batch get and one batch put.
+        key = Conversation.key_for(author.name, to.name)
+        sent_key, received_key = InboxEntry.key_for(author.name, to.name), InboxEntry.key_for(to.name, author.name)
+
+        def txn():
+            conversation, sent, received, inbox = db.get([key, sent_key, received_key, inbox_root(to.name)])
+            if not conversation:
+                user1, user2 = sorted([author.name, to.name])
+                conversation = Conversation(key = key, user1 = user1, user2 = user2)
+            conversation.messages += 1
+
+            m = cls(parent = key, content = content, author = author, author_name = author.name,
+                    created = datetime.now())
+            sent = sent or InboxEntry(key = sent_key, other = to.name)
+            received = received or InboxEntry(key = received_key, other = author.name)
+            for e in (sent, received):
+                e.last_author = author.name
+                e.last_content = preview(content, PREVIEW_LENGTH)
+                e.updated = m.created
+            received.unread += 1
+            inbox = inbox or Inbox(key = inbox_root(to.name))
+            inbox.unread += 1
+
+            db.put([conversation, m, sent, received, inbox])
+            return m
+
+        return db.run_in_transaction_options(db.create_transaction_options(xg = True), txn)
+
+
+
+class Inbox(db.Model):
+    #The number of unread messages of a user, at inbox_root(user), the
+    #parent of their InboxEntries and updated in the same transactions.
+    unread = db.IntegerProperty(default = 0)
 
+    @classmethod
+    def unread_of(cls, name):
+        inbox = cls.get(inbox_root(name))
+        return inbox and inbox.unread or 0
+
+
+class InboxEntry(db.Model):
+    #One conversation in the inbox of a user, keyed by the name of the other
+    #user under inbox_root(user). The unread count and a preview of the last
+    #message are copied in when a message is sent, so an inbox page is one
+    #ancestor query on updated, whatever the number of messages.
+    other = db.StringProperty(required = True)
+    unread = db.IntegerProperty(default = 0)
+    last_author = db.StringProperty(required = False)
+    last_content = db.StringProperty(required = False, multiline = True)
+    updated = db.DateTimeProperty(required = False)
 
+    @staticmethod
+    def key_for(name, other):
+        return db.Key.from_path('InboxEntry', other, parent = inbox_root(name))
 
+    @classmethod
+    def by_user(cls, name):
+        q = cls.all()
+        q.ancestor(inbox_root(name))
+        q.order('-updated')
+        return q
 
-        
\ No newline at end of file
+    @classmethod
+    def mark_read(cls, name, other):
+        #one get when there is nothing unread, the usual case
+        e = cls.get(cls.key_for(name, other))
+        if not (e and e.unread):
+            return
+
+        def txn():
+            e, inbox = db.get([cls.key_for(name, other), inbox_root(name)])
+            if inbox:
+                inbox.unread = max(0, inbox.unread - e.unread)
+                inbox.put()
+            e.unread = 0
+            e.put()
+        db.run_in_transaction(txn)
@@ -0,0 +1,31 @@
+import json
+from difflib import SequenceMatcher
+
+#A delta rebuilds a text from another one (for page revisions: an older
+#revision from its successor). It is a JSON list of operations on the lines
+#of the base text:
+#   [i1, i2]   copy the lines i1:i2 of the base
+#   "text"     insert text
+
+def _lines(s):
+    return s.splitlines(True)
+
+def make(base, target):
+    a, b = _lines(base), _lines(target)
+    ops = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk = False).get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j1 != j2:
+            ops.append(''.join(b[j1:j2]))
+    return json.dumps(ops, separators = (',', ':'))
+
+def apply(base, delta):
+    a = _lines(base)
+    out = []
+    for op in json.loads(delta):
+        if isinstance(op, list):
+            out.extend(a[op[0]:op[1]])
+        else:
+            out.append(op)
+    return u''.join(out)
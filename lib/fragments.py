@@ -0,0 +1,54 @@
+import random
+import time
+
+from google.appengine.api import memcache
+
+#Rendered template fragments shared by every viewer, see the {% cache %} tag
+#in lib/templates.py. A fragment is stored under the current version of its
+#name; a write bumps the version instead of deleting the rendered copies.
+FRAGMENT_TTL = 24 * 3600
+
+#the fragments in use, with what makes them change
+SITE_MAP = 'site_map'    #an edit of a new page (SiteMap.touch)
+RECENT = 'recent'        #a new comment (RecentComments.add)
+
+
+def version_key(name):
+    return 'fragment-version:' + name
+
+def fragment_key(name, version):
+    return 'fragment:%s:%s' % (name, version)
+
+def _fresh():
+    #After an eviction the counter restarts from the clock in microseconds,
+    #shifted left for a few random bits. The old counter gained one per bump:
+    #it would take more than 256 bumps a microsecond to reach the new start,
+    #so that never lands on a number whose fragment may still be cached. It
+    #stays under the 64 bits memcache.incr() counts with.
+    return int(time.time() * 1000000) << 8 | random.getrandbits(8)
+
+def version(name):
+    v = memcache.get(version_key(name))
+    if v is None:
+        v = _fresh()
+        if not memcache.add(version_key(name), v):
+            v = memcache.get(version_key(name)) or v
+    return v
+
+def bump(name):
+    if memcache.incr(version_key(name)) is None:
+        memcache.set(version_key(name), _fresh())
+
+
+def get(name):
+    #returns the memcache key of the current version of the fragment, to
+    #store it under after a miss, and the cached html or None
+    key = fragment_key(name, version(name))
+    return key, memcache.get(key)
+
+def store(key, html):
+    #a write between get() and store() only leaves an unused old version
+    try:
+        memcache.set(key, html, time = FRAGMENT_TTL)
+    except ValueError:
+        pass
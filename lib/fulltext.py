@@ -0,0 +1,154 @@
+import logging
+
+from google.appengine.api import search, taskqueue
+from google.appengine.ext import db
+
+from lib import data
+
+#Full-text search over the current version of each page and over the
+#comments, with the Search API: the service keeps the inverted index, a
+#query never reads the entities. Documents are written when a page is saved
+#or a comment posted; reindex() rebuilds the index from the datastore, in
+#tasks of REINDEX_BATCH entities.
+INDEX_NAME = 'wiki'
+RESULTS_PER_PAGE = 20
+#most documents per Index.put
+REINDEX_BATCH = 200
+REINDEX_URL = '/_admin/search/reindex'
+
+
+def _index():
+    return search.Index(name = INDEX_NAME)
+
+def page_doc_id(path):
+    return 'page:' + path
+
+def comment_doc_id(c):
+    return 'comment:' + str(c.key())
+
+
+def page_document(p):
+    #p is the PageHead of the path
+    return search.Document(
+        doc_id = page_doc_id(p.pathPage),
+        fields = [search.AtomField(name = 'kind', value = 'page'),
+                  search.AtomField(name = 'path', value = p.pathPage),
+                  search.AtomField(name = 'url', value = p.pathPage),
+                  search.HtmlField(name = 'content', value = p.content or ''),
+                  search.DateField(name = 'updated', value = p.lastModified)])
+
+def comment_document(c):
+    return search.Document(
+        doc_id = comment_doc_id(c),
+        fields = [search.AtomField(name = 'kind', value = 'comment'),
+                  search.AtomField(name = 'path', value = c.pathPage),
+                  search.AtomField(name = 'url', value = c.url()),
+                  search.AtomField(name = 'author', value = data.author_name(c)),
+                  search.TextField(name = 'content', value = c.content),
+                  search.DateField(name = 'updated', value = c.created)])
+
+
+def _put(documents):
+    #a failed write only leaves the index behind until the next reindex, it
+    #must not fail the edit or the comment
+    try:
+        _index().put(documents)
+    except search.Error:
+        logging.warning('search index write failed for %s', [d.doc_id for d in documents])
+
+def index_page(p):
+    _put([page_document(p)])
+
+def index_comment(c):
+    _put([comment_document(c)])
+
+def index_comments(comments):
+    if comments:
+        _put([comment_document(c) for c in comments])
+
+def unindex(doc_ids):
+    #like _put, a failure only leaves documents behind until the next reindex
+    if not doc_ids:
+        return
+    try:
+        _index().delete(doc_ids)
+    except search.Error:
+        logging.warning('search index delete failed for %s', doc_ids)
+
+
+##### queries
+class Result(object):
+    def __init__(self, doc):
+        fields = dict((f.name, f.value) for f in doc.fields)
+        self.kind = fields.get('kind')
+        self.path = fields.get('path')
+        self.url = fields.get('url')
+        self.author = fields.get('author')
+        #the content around the words found
+        snippets = dict((e.name, e.value) for e in doc.expressions)
+        self.snippet = snippets.get('content', '')
+
+
+def _query(q, cursor, size):
+    options = search.QueryOptions(
+        limit = size,
+        cursor = search.Cursor(web_safe_string = cursor) if cursor else search.Cursor(),
+        sort_options = search.SortOptions(
+            match_scorer = search.MatchScorer(),
+            expressions = [search.SortExpression(expression = '_score',
+                                                 direction = search.SortExpression.DESCENDING,
+                                                 default_value = 0.0)]),
+        returned_fields = ['kind', 'path', 'url', 'author'],
+        snippeted_fields = ['content'])
+    return _index().search(search.Query(query_string = q, options = options))
+
+def find(q, cursor = None, prev = None, size = RESULTS_PER_PAGE):
+    #(results, data.Pager) of the documents matching q, by relevance
+    prev = prev.split(',') if prev else []
+    query = q
+    try:
+        found = _query(query, cursor, size)
+    except search.QueryError:
+        #not the query syntax, look for each word itself
+        query = ' '.join('"%s"' % w for w in q.replace('"', ' ').split())
+        found = _query(query, cursor, size)
+    except ValueError:
+        #bad cursor, back to the first page
+        cursor, prev = None, []
+        found = _query(query, None, size)
+
+    next_cursor = found.cursor and found.cursor.web_safe_string
+    return ([Result(d) for d in found.results],
+            data.Pager(cursor, prev, next_cursor, {'q': q.encode('utf-8')}))
+
+
+##### rebuilding the index
+def _schedule_reindex(kind, cursor):
+    taskqueue.add(url = REINDEX_URL, params = {'kind': kind, 'cursor': cursor or ''})
+
+def reindex(kind = 'page', cursor = None):
+    #Indexes one batch of kind ('page' or 'comment') and schedules the next
+    #one, the kinds one after the other.
+    if kind == 'page':
+        #the paths come from the site map, their PageHead gives the content
+        paths = [e.pathPage for e in data.SiteMap.all_pages()]
+        start = int(cursor or 0)
+        batch = paths[start:start + REINDEX_BATCH]
+        heads = db.get([data.PageHead.key_for(path) for path in batch])
+        #pages not edited since PageHead was introduced
+        heads = [h or data.PageHead.by_path(path) for path, h in zip(batch, heads)]
+        _put([page_document(p) for p in heads if p])
+        if start + REINDEX_BATCH < len(paths):
+            return _schedule_reindex(kind, str(start + REINDEX_BATCH))
+        return _schedule_reindex('comment', None)
+
+    q = data.Comment.all()
+    if cursor:
+        q.with_cursor(cursor)
+    comments = q.fetch(REINDEX_BATCH)
+    #comments written before pathPage was stored have no page to link to
+    comments_with_path = [c for c in comments if c.pathPage]
+    if comments_with_path:
+        _put([comment_document(c) for c in data.prefetch_authors(comments_with_path)])
+    if len(comments) == REINDEX_BATCH:
+        _schedule_reindex(kind, q.cursor())
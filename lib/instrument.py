@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from google.appengine.api import apiproxy_stub_map
+
+from lib import trace
+
+#WSGI middleware wrapping the application: each request is traced (see
+#lib/trace.py) with the number and duration of its datastore and memcache
+#calls, its render time and its wall time. In debug mode the totals are also
+#sent back as X-Trace-* response headers, which benchmarks and tests read.
+
+#Most calls a request of a handler is expected to make, by service. A request
+#over budget is logged as a warning, flagged in the X-Trace-Over-Budget
+#header and counted on /_admin/trace.
+BUDGETS = {
+    'WikiPage.get': {'datastore_v3': 2, 'memcache': 11},
+    'UserPage.get': {'datastore_v3': 2, 'memcache': 11},
+    'CommentPage.get': {'datastore_v3': 4, 'memcache': 8},
+    'HistoryPage.get': {'datastore_v3': 3, 'memcache': 7},
+    'EditPage.get': {'datastore_v3': 2, 'memcache': 6},
+    'SearchPage.get': {'datastore_v3': 1, 'memcache': 6},
+    'WikiPage.post': {'datastore_v3': 2, 'memcache': 12},
+    'UserPage.post': {'datastore_v3': 2, 'memcache': 12},
+    'CommentPage.post': {'datastore_v3': 4, 'memcache': 12},
+    'VotePage.post': {'datastore_v3': 5, 'memcache': 4},
+    'InboxPage.get': {'datastore_v3': 2, 'memcache': 6},
+    'ConversationPage.get': {'datastore_v3': 3, 'memcache': 7},
+    'ConversationPage.post': {'datastore_v3': 5, 'memcache': 3},
+}
+
+SERVICES = ('datastore_v3', 'memcache')
+
+_over_budget = defaultdict(int)
+_lock = threading.Lock()
+
+
+def over_budget(t):
+    #[(service, calls, budget)] for the services over the budget of t.name
+    budget = BUDGETS.get(t.name, {})
+    calls = t.services()
+    return [(s, calls[s], budget[s]) for s in sorted(budget) if calls[s] > budget[s]]
+
+def budget_stats():
+    with _lock:
+        return dict(_over_budget)
+
+
+##### API call hooks
+def _pre_call(service, call, request, response):
+    t = trace.current()
+    if t is not None and service in SERVICES:
+        t.calls['%s.%s' % (service, call)] += 1
+        t.pending[id(request)] = time.time()
+
+def _post_call(service, call, request, response):
+    #asynchronous calls are timed from their start to the time their result
+    #is used, so overlapping calls count for more than the wall time
+    t = trace.current()
+    if t is not None:
+        start = t.pending.pop(id(request), None)
+        if start is not None:
+            t.call_ms[service] += (time.time() - start) * 1000
+
+_hooked = None
+
+def install_hooks():
+    #the stub map is replaced by testbed, hook the current one
+    global _hooked
+    proxy = apiproxy_stub_map.apiproxy
+    if proxy is not _hooked:
+        proxy.GetPreCallHooks().Append('trace', _pre_call)
+        proxy.GetPostCallHooks().Append('trace', _post_call)
+        _hooked = proxy
+
+
+class Middleware(object):
+    def __init__(self, app, debug = False):
+        self.app = app
+        self.debug = debug
+
+    def headers(self, t):
+        calls = t.services()
+        h = [('X-Trace-Handler', t.name),
+             ('X-Trace-Wall-Ms', '%.1f' % t.ms()),
+             ('X-Trace-Render-Ms', '%.1f' % t.stage_ms('render'))]
+        for s in SERVICES:
+            h.append(('X-Trace-%s-Calls' % s, str(calls[s])))
+            h.append(('X-Trace-%s-Ms' % s, '%.1f' % t.call_ms[s]))
+        over = over_budget(t)
+        if over:
+            h.append(('X-Trace-Over-Budget', ','.join(s for s, n, b in over)))
+        return h
+
+    def __call__(self, environ, start_response):
+        install_hooks()
+        t = trace.begin('unrouted', environ.get('PATH_INFO', ''))
+        status = []
+
+        def traced_start_response(s, headers, exc_info = None):
+            #webapp2 starts the response once the handler is done
+            status.append(s.split(' ', 1)[0])
+            if self.debug:
+                headers = headers + self.headers(t)
+            return start_response(s, headers, exc_info)
+
+        try:
+            return self.app(environ, traced_start_response)
+        finally:
+            trace.end(status and status[0] or '500')
+            over = over_budget(t)
+            if over:
+                with _lock:
+                    _over_budget[t.name] += 1
+                logging.warning('%s %s over rpc budget: %s', t.name, t.path,
+                                ', '.join('%s=%d>%d' % o for o in over))
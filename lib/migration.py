@@ -0,0 +1,123 @@
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+
+from lib import data, fulltext
+
+#One-shot move of the comments stored before threading: the Comments get a
+#thread_path, then each SubComment is replaced by an answer Comment, its
+#votes and search document moved along. Runs in tasks of BATCH entities
+#chained like fulltext.reindex(); every step can run again after a failed
+#task without duplicating anything.
+MIGRATE_URL = '/_admin/migrate/comments'
+BATCH = 100
+
+
+def _schedule(kind, cursor):
+    taskqueue.add(url = MIGRATE_URL, params = {'kind': kind, 'cursor': cursor or ''})
+
+
+def _parent_key(s):
+    #the parent key of a SubComment is ('comments', path, 'comments', c_id),
+    #or the Comment itself in the 'thread' layout
+    k = s.key().parent()
+    if k.kind() != 'Comment':
+        k = db.Key.from_path('Comment', k.id(), parent = k.parent())
+    return k
+
+def _answer(s, c):
+    #The Comment replacing s, an answer to c. It is in the entity group of s:
+    #it is put in the same transaction that stores its key on s, so a rerun
+    #finds it instead of creating another one.
+    def txn():
+        s2 = data.SubComment.get(s.key())
+        if not s2:
+            return None
+        if s2.migrated_to:
+            return data.Comment.get(s2.migrated_to)
+        #the raw author key: reading s2.author would get the User, another
+        #entity group, inside the transaction
+        author = data.SubComment.author.get_value_for_datastore(s2)
+        a = data.Comment(parent = c.thread_root(), content = s2.content, author = author,
+                         author_name = s2.author_name, pathPage = c.pathPage, created = s2.created,
+                         comment_level = 2, thread_path = c.thread_path + data.thread_segment(s2.created),
+                         reply_to = c)
+        a.put()
+        s2.migrated_to = str(a.key())
+        s2.put()
+        return a
+    return db.run_in_transaction(txn)
+
+def _move_votes(old, new):
+    #copies the shards and total of the comment key old to the comment key
+    #new, then deletes them: a rerun finds nothing left, or copies them again
+    keys = [data.VoteShard.key_for(old, i) for i in xrange(data.VOTE_SHARDS)] + [data.VoteTotal.key_for(old)]
+    found = [e for e in db.get(keys) if e]
+    if not found:
+        return
+    moved = []
+    for e in found:
+        if isinstance(e, data.VoteShard):
+            shard = int(e.key().name().rsplit('|', 1)[1])
+            moved.append(data.VoteShard(key = data.VoteShard.key_for(new, shard), target = new, up = e.up, down = e.down))
+        else:
+            moved.append(data.VoteTotal(key = data.VoteTotal.key_for(new), up = e.up, down = e.down))
+    db.put(moved)
+    db.delete(found)
+
+
+def threads(kind = 'comment', cursor = None):
+    #Migrates one batch of kind ('comment' or 'subcomment') and schedules the
+    #next one, the Comments first: answers need the thread_path of theirs.
+    model = data.Comment if kind == 'comment' else data.SubComment
+    q = model.all()
+    if cursor:
+        q.with_cursor(cursor)
+    batch = q.fetch(BATCH)
+
+    if kind == 'comment':
+        todo = [c for c in batch if not c.thread_path]
+        for c in todo:
+            c.thread_path = data.thread_segment(c.created)
+            c.comment_level = 1
+            if not c.pathPage and c.thread_root().kind() == 'comments':
+                c.pathPage = c.thread_root().name()
+        db.put(todo)
+    else:
+        #answers to comments deleted since are left alone
+        parents = db.get([_parent_key(s) for s in batch])
+        done, answers = [], []
+        for s, c in zip(batch, parents):
+            a = c and _answer(s, c)
+            if a:
+                _move_votes(str(s.key()), str(a.key()))
+                done.append(s)
+                answers.append(a)
+        fulltext.index_comments(data.prefetch_authors(answers))
+        fulltext.unindex([fulltext.comment_doc_id(s) for s in done])
+        db.delete(done)
+
+    if len(batch) == BATCH:
+        _schedule(kind, q.cursor())
+    elif kind == 'comment':
+        _schedule('subcomment', None)
+
+
+#One-shot creation of the UserName of every user stored before it existed,
+#in tasks of BATCH users; the last one sets the Migrated flag that turns off
+#the fallback query of User.by_name().
+USERS_URL = '/_admin/migrate/users'
+
+def user_names(cursor = None):
+    q = data.User.all().ancestor(data.users_key())
+    if cursor:
+        q.with_cursor(cursor)
+    batch = q.fetch(BATCH)
+
+    names = db.get([data.UserName.key_for(u.name) for u in batch])
+    db.put([data.UserName(key = data.UserName.key_for(u.name), user_id = u.key().id())
+            for u, n in zip(batch, names) if not n])
+
+    if len(batch) == BATCH:
+        taskqueue.add(url = USERS_URL, params = {'cursor': q.cursor()})
+    else:
+        data.Migrated.finish(data.USER_NAMES_MIGRATION)
@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+
+from google.appengine.api import memcache
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import db
+
+from lib import data
+
+#users resolved from the user_id cookie, kept in the instance for a short
+#time and in memcache for longer. Users are never changed once created; a
+#profile or password change will have to drop both copies.
+LOCAL_SIZE = 1000
+LOCAL_TTL = 30
+MEMCACHE_TTL = 600
+
+
+class LRUCache(object):
+    #Thread-safe least recently used cache whose entries also expire after
+    #ttl seconds.
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.pop(key, None)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.time():
+                return None
+            self.items[key] = item
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = (value, time.time() + self.ttl)
+            while len(self.items) > self.size:
+                self.items.popitem(last = False)
+
+
+_users = LRUCache(LOCAL_SIZE, LOCAL_TTL)
+
+def _key(uid):
+    return 'user:%d' % uid
+
+def get_user(uid):
+    u = _users.get(uid)
+    if u is not None:
+        return u
+
+    v = memcache.get(_key(uid))
+    if v is not None:
+        u = db.model_from_protobuf(entity_pb.EntityProto(v))
+    else:
+        u = data.User.by_id(uid)
+        if not u:
+            return None
+        memcache.set(_key(uid), db.model_to_protobuf(u).Encode(), time = MEMCACHE_TTL)
+
+    _users.set(uid, u)
+    return u
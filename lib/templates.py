@@ -0,0 +1,74 @@
+import os
+
+import jinja2
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_DIR = os.path.join(ROOT_DIR, 'templates')
+#templates compiled to python modules before deploying, by compile_templates.py
+COMPILED_DIR = os.path.join(ROOT_DIR, 'templates_compiled')
+
+#compiled templates in memcache are shared by new instances, a template
+#edit changes the checksum so they are never stale
+BYTECODE_TIMEOUT = 24 * 3600
+
+
+class FragmentCacheExtension(Extension):
+    #{% cache "name" %}...{% endcache %} renders its body once per version of
+    #"name" and reads it from environment.fragment_cache (lib.fragments) on
+    #the next renders. The data shown in the body should be loaded by the
+    #body itself (a global function), not passed by the handler, so that a
+    #hit skips it. Without a fragment_cache the body is always rendered.
+    tags = set(['cache'])
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache = None)
+
+    def parse(self, parser):
+        lineno = parser.stream.next().lineno
+        args = [parser.parse_expression()]
+        body = parser.parse_statements(['name:endcache'], drop_needle = True)
+        return nodes.CallBlock(self.call_method('_cache', args), [], [], body).set_lineno(lineno)
+
+    def _cache(self, name, caller):
+        fragments = self.environment.fragment_cache
+        if fragments is None:
+            return caller()
+
+        key, html = fragments.get(name)
+        if html is None:
+            html = caller()
+            fragments.store(key, unicode(html))
+        return jinja2.Markup(html)
+
+
+def make_env(loader, bytecode_cache = None):
+    return jinja2.Environment(loader = loader,
+                              autoescape = True,
+                              bytecode_cache = bytecode_cache,
+                              extensions = [FragmentCacheExtension])
+
+def source_env():
+    return make_env(jinja2.FileSystemLoader(TEMPLATE_DIR))
+
+def use_compiled():
+    #the dev server always reads the sources, which are being edited
+    dev = os.environ.get('SERVER_SOFTWARE', '').startswith('Development')
+    return not dev and os.path.isdir(COMPILED_DIR)
+
+def runtime_env():
+    if use_compiled():
+        return make_env(jinja2.ModuleLoader(COMPILED_DIR))
+
+    from google.appengine.api import memcache
+    return make_env(jinja2.FileSystemLoader(TEMPLATE_DIR),
+                    jinja2.MemcachedBytecodeCache(memcache.Client(), timeout = BYTECODE_TIMEOUT))
+
+def template_names():
+    return sorted(n for n in os.listdir(TEMPLATE_DIR) if n.endswith('.html'))
+
+def warm_up(env):
+    for name in template_names():
+        env.get_template(name)
@@ -0,0 +1,133 @@
+import logging
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+#Per-request timing of the stages of a handler (user lookup, page fetch,
+#thread load, render...) and of its API calls (see lib/instrument.py).
+#Every trace is logged at debug level, one in SAMPLE_EVERY at info level so
+#production logs keep a sample, and the last WINDOW values of each handler
+#and series are kept in the instance for the percentiles and histograms of
+#/_admin/trace.
+SAMPLE_EVERY = 100
+WINDOW = 1000
+
+#histogram buckets, by upper bound: durations (ms) and numbers of calls
+MS_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+CALL_BUCKETS = (0, 1, 2, 5, 10, 20, 50)
+
+_local = threading.local()
+
+_series = defaultdict(lambda: deque(maxlen = WINDOW))
+_lock = threading.Lock()
+
+
+class Trace(object):
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.start = time.time()
+        self.stages = []
+        #'service.Call' -> count, 'service' -> ms
+        self.calls = defaultdict(int)
+        self.call_ms = defaultdict(float)
+        #id(request) -> start time of the calls in progress
+        self.pending = {}
+
+    def ms(self):
+        return (time.time() - self.start) * 1000
+
+    def stage_ms(self, name):
+        return sum(ms for s, ms in self.stages if s == name)
+
+    def services(self):
+        #service -> number of calls
+        d = defaultdict(int)
+        for call, n in self.calls.iteritems():
+            d[call.split('.')[0]] += n
+        return d
+
+    def summary(self, status, total):
+        stages = ' '.join('%s=%.1f' % s for s in self.stages)
+        rpcs = ' '.join('%s=%d/%.1fms' % (s, n, self.call_ms[s])
+                        for s, n in sorted(self.services().iteritems()))
+        return '%s %s %s total=%.1fms %s %s' % (self.name, self.path, status, total, stages, rpcs)
+
+
+def current():
+    return getattr(_local, 'trace', None)
+
+def begin(name, path):
+    _local.trace = Trace(name, path)
+    return _local.trace
+
+def set_name(name):
+    #the route is only known once the request is dispatched
+    t = current()
+    if t is not None:
+        t.name = name
+
+def end(status):
+    t = current()
+    if t is None:
+        return
+    _local.trace = None
+
+    total = t.ms()
+    with _lock:
+        _series[t.name, 'total'].append(total)
+        for name, ms in t.stages:
+            _series[t.name, name].append(ms)
+        for service, n in t.services().iteritems():
+            _series[t.name, service + '.calls'].append(n)
+            _series[t.name, service + '.ms'].append(t.call_ms[service])
+
+    level = logging.INFO if random.randrange(SAMPLE_EVERY) == 0 else logging.DEBUG
+    logging.log(level, t.summary(status, total))
+    return t
+
+@contextmanager
+def stage(name):
+    #stages are also usable outside of a request (warmup, tasks, benchmarks)
+    #and are then not recorded
+    start = time.time()
+    try:
+        yield
+    finally:
+        t = current()
+        if t is not None:
+            t.stages.append((name, (time.time() - start) * 1000))
+
+
+def percentile(values, p):
+    #nearest rank, on sorted values
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def histogram(values, buckets):
+    #[(upper bound, count)], the last bound being None for the rest
+    counts = [0] * (len(buckets) + 1)
+    for v in values:
+        i = 0
+        while i < len(buckets) and v > buckets[i]:
+            i += 1
+        counts[i] += 1
+    return zip(list(buckets) + [None], counts)
+
+def stats():
+    #{handler: {series: {count, p50, p95, histogram}}} over the last WINDOW
+    #requests of each handler
+    with _lock:
+        items = [(k, sorted(v)) for k, v in _series.iteritems()]
+
+    out = defaultdict(dict)
+    for (handler, name), values in items:
+        buckets = CALL_BUCKETS if name.endswith('.calls') else MS_BUCKETS
+        out[handler][name] = dict(count = len(values),
+                                  p50 = round(percentile(values, 50), 1),
+                                  p95 = round(percentile(values, 95), 1),
+                                  histogram = histogram(values, buckets))
+    return dict(out)
@@ -0,0 +1,131 @@
+import base64
+
+from google.appengine.api import datastore, datastore_types
+from google.appengine.datastore import datastore_query, entity_pb
+
+#Line-delimited dump of the datastore: one entity per line, its kind then its
+#encoded protocol buffer in base64, so keys, parents, references and dates
+#come back exactly. Entities are read and written with the low-level
+#datastore API, the models would set their auto_now dates again on put.
+#
+#The keys in a dump carry the id of the app it was exported from. On import
+#every key, reference and key stored in a key name is moved to the app
+#running the import, so a dump can be restored into another app (e.g. from
+#appspot to the dev server).
+#
+#After each batch an export writes a checkpoint line, '#<kind> <cursor>'; an
+#interrupted export restarts from the last one. Imports put entities by key,
+#replaying lines already imported is harmless.
+KINDS = ('User', 'UserName', 'Page', 'PageHead', 'SiteMap', 'Comment', 'SubComment',
+         'VoteShard', 'VoteTotal', 'Vote', 'Conversation', 'Dialogue', 'Inbox', 'InboxEntry',
+         'Migrated')
+BATCH_SIZE = 500
+#kinds whose key name starts with the str() of a comment key, then '|'
+#for some of them, and the properties holding one
+KEY_NAMED = ('VoteShard', 'VoteTotal', 'Vote')
+KEY_PROPERTIES = {'VoteShard': ('target',)}
+
+
+def dump(entity):
+    return '%s %s\n' % (entity.kind(), base64.b64encode(entity.ToPb().Encode()))
+
+def load(line):
+    kind, value = line.split(' ', 1)
+    return rekey(datastore.Entity.FromPb(entity_pb.EntityProto(base64.b64decode(value))))
+
+
+##### moving entities to the current app
+def _key(key):
+    #the same path in the current app
+    return datastore_types.Key.from_path(*key.to_path(), namespace = key.namespace())
+
+def _encoded_key(s):
+    return str(_key(datastore_types.Key(s)))
+
+def _name(kind, name):
+    if kind in KEY_NAMED and name:
+        target, sep, rest = name.partition('|')
+        return _encoded_key(target) + sep + rest
+    return name
+
+def _value(v):
+    if isinstance(v, datastore_types.Key):
+        return _key(v)
+    if isinstance(v, list):
+        return [_value(x) for x in v]
+    return v
+
+def rekey(e):
+    #a copy of the Entity e with its key and references in the current app
+    key = e.key()
+    parent = key.parent()
+    moved = datastore.Entity(key.kind(), parent = parent and _key(parent),
+                             name = _name(key.kind(), key.name()), id = key.id(),
+                             namespace = key.namespace(),
+                             unindexed_properties = e.unindexed_properties())
+    for name, v in e.iteritems():
+        if name in KEY_PROPERTIES.get(key.kind(), ()):
+            v = _encoded_key(v)
+        moved[name] = _value(v)
+    return moved
+
+
+def checkpoint_line(kind, cursor):
+    return '#%s %s\n' % (kind, cursor)
+
+def parse_checkpoint(line):
+    #(kind, cursor) of a checkpoint line, None for an entity line
+    if not line.startswith('#'):
+        return None
+    kind, cursor = line[1:].rstrip('\n').split(' ', 1)
+    return kind, cursor
+
+
+def export(out, kinds = KINDS, start = None, batch_size = BATCH_SIZE, progress = None):
+    #Writes the entities of kinds to the file out, from the checkpoint start
+    #((kind, cursor), the whole kinds when None). progress(count) is called
+    #after each batch. Returns the number of entities written.
+    kinds = list(kinds)
+    if start:
+        kinds = kinds[kinds.index(start[0]):]
+
+    count = 0
+    for kind in kinds:
+        cursor = start and start[0] == kind and start[1] or None
+        while True:
+            q = datastore.Query(kind, cursor = cursor and datastore_query.Cursor(urlsafe = cursor))
+            batch = q.Get(batch_size)
+            out.write(''.join(dump(e) for e in batch))
+            cursor = q.GetCursor().urlsafe()
+            out.write(checkpoint_line(kind, cursor))
+            count += len(batch)
+            if progress:
+                progress(count)
+            if len(batch) < batch_size:
+                break
+    return count
+
+def import_(lines, skip = 0, batch_size = BATCH_SIZE, progress = None):
+    #Puts the entities of the dump lines, past the first skip entities (the
+    #checkpoint of an interrupted import). progress(count) is called after
+    #each batch with the number of entities done, skip included. Returns the
+    #number of entities of lines.
+    count = 0
+    batch = []
+    for line in lines:
+        if not line.strip() or parse_checkpoint(line):
+            continue
+        count += 1
+        if count <= skip:
+            continue
+        batch.append(load(line.rstrip('\n')))
+        if len(batch) == batch_size:
+            datastore.Put(batch)
+            batch = []
+            if progress:
+                progress(count)
+    if batch:
+        datastore.Put(batch)
+        if progress:
+            progress(count)
+    return count
@@ -0,0 +1,120 @@
+import random
+
+from google.appengine.api import memcache, taskqueue
+from google.appengine.ext import db
+
+from lib import data, cache
+
+#Votes are counted in memcache first. The first vote buffered for a comment
+#schedules a flush FLUSH_DELAY seconds later, which moves the buffered counts
+#to a random VoteShard and refreshes the comment's VoteTotal: whatever the
+#vote rate, a comment costs one shard write and one total write per delay.
+#Buffered votes are lost if memcache evicts them before the flush. Each user
+#votes once per comment, recorded as a Vote before anything is counted.
+FLUSH_DELAY = 10
+FLUSH_URL = '/_admin/votes/flush'
+
+DIRECTIONS = ('up', 'down')
+
+
+def pending_key(target, direction):
+    return 'votes:pending:%s:%s' % (target, direction)
+
+def total_key(target):
+    return 'votes:total:' + target
+
+
+def _schedule(target):
+    taskqueue.add(url = FLUSH_URL, params = {'target': target}, countdown = FLUSH_DELAY)
+
+def _add_to_shard(target, up, down):
+    def txn():
+        k = data.VoteShard.key_for(target, random.randint(0, data.VOTE_SHARDS - 1))
+        shard = data.VoteShard.get(k) or data.VoteShard(key = k, target = target)
+        shard.up += up
+        shard.down += down
+        shard.put()
+    db.run_in_transaction(txn)
+
+
+def _record(target, voter, direction):
+    #False when voter (a user id) already voted on target
+    def txn():
+        k = data.Vote.key_for(target, voter)
+        if data.Vote.get(k):
+            return False
+        data.Vote(key = k, direction = direction).put()
+        return True
+    return db.run_in_transaction(txn)
+
+def vote(target, voter, direction):
+    #target is the str() of a stored Comment key, voter the id of the User.
+    #Returns False when the user had already voted on it.
+    if not _record(target, voter, direction):
+        return False
+
+    n = memcache.incr(pending_key(target, direction), initial_value = 0)
+    if n is None:
+        #memcache unavailable, count it directly
+        _add_to_shard(target, int(direction == 'up'), int(direction == 'down'))
+        fold(target)
+    elif n == 1:
+        _schedule(target)
+    return True
+
+def flush(target):
+    counts = {}
+    for d in DIRECTIONS:
+        counts[d] = memcache.get(pending_key(target, d)) or 0
+
+    if counts['up'] or counts['down']:
+        _add_to_shard(target, counts['up'], counts['down'])
+        for d in DIRECTIONS:
+            if counts[d] and memcache.decr(pending_key(target, d), counts[d]):
+                #votes arrived while flushing, their incr did not schedule a flush
+                _schedule(target)
+    fold(target)
+
+def fold(target):
+    shards = db.get([data.VoteShard.key_for(target, i) for i in xrange(data.VOTE_SHARDS)])
+    total = data.VoteTotal(key = data.VoteTotal.key_for(target),
+                           up = sum(s.up for s in shards if s),
+                           down = sum(s.down for s in shards if s))
+    total.put()
+    memcache.set(total_key(target), (total.up, total.down))
+
+    #the pages showing the counts are no longer current
+    path = _path_of(target)
+    if path:
+        cache.touch_thread(path)
+
+def _path_of(target):
+    #the root of a comment key is ('comments', path), or the top-level
+    #Comment itself in the 'thread' layout
+    root = db.Key(target)
+    while root.parent():
+        root = root.parent()
+    if root.kind() == 'comments':
+        return root.name()
+    c = db.get(root)
+    return c and c.pathPage
+
+
+def attach(comments):
+    #Sets upVotes/downVotes of Comments from the totals, with one memcache
+    #call and at most one batch get.
+    comments = list(comments)
+    targets = [str(c.key()) for c in comments]
+    totals = memcache.get_multi(targets, key_prefix = 'votes:total:')
+
+    missing = [t for t in targets if t not in totals]
+    if missing:
+        found = {}
+        for t, v in zip(missing, db.get([data.VoteTotal.key_for(t) for t in missing])):
+            found[t] = v and (v.up, v.down) or (0, 0)
+        memcache.set_multi(found, key_prefix = 'votes:total:')
+        totals.update(found)
+
+    for c, t in zip(comments, targets):
+        c.upVotes, c.downVotes = totals[t]
+    return comments